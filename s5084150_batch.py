@@ -0,0 +1,132 @@
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+from s5084150_game import Grid, diffculty_map, grade_bands
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# make_puzzle Function Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def make_puzzle(task):
+    """Generates one puzzle in a worker process.
+
+    Args:
+        task ((int), (int), (int), (int), (int), (bool), (bool), (bool), (bool)): Index, size,
+            diffculty, base, seed, if solutions are kept, if grids are built, if they have one
+            solution and if their grade has to match the diffculty.
+
+    Returns:
+        (string): The puzzle as one line of JSON.
+
+    """
+    index, size, diffculty, base, seed, solutions, constructive, unique, graded = task
+    start = time.perf_counter()
+    # Not lazy unless it is a marathon grid, lazy grids are accepted differently so a seed
+    # would make a different puzzle with and without solutions.
+    grid = Grid(size, diffculty, base, seed=seed, constructive=constructive,
+                unique=unique, band=grade_bands[diffculty] if graded else None)
+    # Marathon grids are only counted, listing their solutions would find every one of them.
+    puzzle = grid.to_dict(solutions and not grid.lazy)
+    if graded:
+        puzzle["grade"] = grid.rating
+    puzzle["index"] = index
+    puzzle["generate_time"] = time.perf_counter()-start
+    return json.dumps(puzzle)
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# make_puzzle Function End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# generate Function Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def generate(output, sizes, diffculties, count, base=10, seed=0, workers=None, solutions=False,
+             constructive=False, unique=False, graded=False, report=sys.stderr):
+    """Generates puzzles in bulk across a pool of processes.
+
+    Every puzzle gets its own seed from a generator seeded with seed, so a run
+    with the same arguments makes the same puzzles no matter which process
+    builds them. Each puzzle is written as a JSON line as soon as it is finished.
+
+    Args:
+        output (file): File to write the JSON lines to.
+        sizes (int)[]: Grid sizes to generate.
+        diffculties (int)[]: Levels of diffculty to generate.
+        count (int): Amount of puzzles for each (size, diffculty).
+        base (int): Number base saved with the puzzles.
+        seed (int): Seed for the puzzle seeds.
+        workers (int): Amount of processes, None for every core.
+        solutions (bool): Also write the values of every solution.
+        constructive (bool): Build grids a missing number at a time instead of regenerating them.
+        unique (bool): Only make grids with exactly one solution.
+        graded (bool): Only keep grids whose grade is in the band of their diffculty.
+        report (file): File to write the progress to, None for no progress.
+
+    Returns:
+        (float): Puzzles generated per second.
+
+    """
+    seeds = random.Random(seed)
+    tasks = []
+    for size in sizes:
+        for diffculty in diffculties:
+            for i in range(count):
+                tasks.append((len(tasks), size, diffculty, base, seeds.getrandbits(64), solutions,
+                              constructive, unique, graded))
+    start = time.perf_counter()
+    done = 0
+    with multiprocessing.Pool(workers) as pool:
+        for line in pool.imap_unordered(make_puzzle, tasks):
+            output.write(line+"\n")
+            output.flush()
+            done += 1
+            if report and (done % 100 == 0 or done == len(tasks)):
+                rate = done/(time.perf_counter()-start)
+                print("{0}/{1} puzzles, {2:.1f} puzzles/s".format(done, len(tasks), rate), file=report)
+    return done/(time.perf_counter()-start)
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# generate Function End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Main Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate puzzles in bulk as JSON lines.")
+    parser.add_argument("output", help="File to write puzzles to, - for stdout.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=sorted(diffculty_map[1]))
+    parser.add_argument("--diffculties", type=int, nargs="+", default=sorted(diffculty_map))
+    parser.add_argument("--count", type=int, default=100, help="Puzzles for each size and diffculty.")
+    parser.add_argument("--base", type=int, default=10, choices=[2, 8, 10, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="Processes to use, every core by default.")
+    parser.add_argument("--solutions", action="store_true", help="Also write every solution.")
+    parser.add_argument("--constructive", action="store_true", help="Build grids instead of regenerating them.")
+    parser.add_argument("--unique", action="store_true", help="Only make grids with one solution.")
+    parser.add_argument("--graded", action="store_true", help="Only keep grids graded at their diffculty.")
+    args = parser.parse_args()
+    if args.unique and args.graded:
+        parser.error("--unique grids cannot be --graded")
+    if args.output == "-":
+        rate = generate(sys.stdout, args.sizes, args.diffculties, args.count, args.base,
+                        args.seed, args.workers, args.solutions, args.constructive,
+                        args.unique, args.graded)
+    else:
+        with open(args.output, "w") as output:
+            rate = generate(output, args.sizes, args.diffculties, args.count, args.base,
+                            args.seed, args.workers, args.solutions, args.constructive,
+                            args.unique, args.graded)
+    print("Finished at {0:.1f} puzzles/s".format(rate), file=sys.stderr)
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Main End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
@@ -0,0 +1,228 @@
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import s5084150_game as game
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Timing Functions Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def measure(function, repeat, number=1):
+    """Times a function a number of times.
+
+    Args:
+        function (function): Function to time, called with no arguments.
+        repeat (int): Amount of timings to take.
+        number (int): Calls in each timing, the timing is divided by it.
+
+    Returns:
+        {(string): (float)}: Min, median and mean seconds per call and the repeat.
+
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number):
+            function()
+        times.append((time.perf_counter()-start)/number)
+    return {"min": min(times), "median": statistics.median(times),
+            "mean": statistics.mean(times), "repeat": repeat}
+
+
+def seed_for(*keys):
+    """Gets a fixed seed for a benchmark from its keys so every run uses the same grids."""
+    return sum(key*(1000**i) for i, key in enumerate(keys))
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Timing Functions End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Benchmark Functions Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def bench_evaluate(results, size, repeat):
+    """Times evaluate against a compiled equation on random rows of a size."""
+    rng = random.Random(seed_for(size))
+    n = size//2
+    rows = []
+    for i in range(100):
+        numbers = sum([rng.sample(range(1, game.digits+1), stop-start) for start, stop in game.segments(n)], [])
+        operators = [rng.choice(game.codes) for j in range(n-1)]
+        rows.append((numbers, operators, sum([[str(numbers[j]), operators[j]] for j in range(n-1)], [])
+                     + [str(numbers[-1])]))
+    def run_evaluate():
+        for numbers, operators, equation in rows:
+            game.evaluate(equation, 0, len(equation)-1)
+    def run_compiled():
+        for numbers, operators, equation in rows:
+            game.compile_equation(operators)(numbers)
+    results["evaluate/string/{0}".format(size)] = measure(run_evaluate, repeat, 10)
+    results["evaluate/compiled/{0}".format(size)] = measure(run_compiled, repeat, 10)
+
+
+def bench_permutations(results, size, diffculty, repeat):
+    """Times the permutations of the numbers missing from the longest run of a row."""
+    r = max(game.missing_counts(size, diffculty))
+    start, stop = game.segments(size//2)[0]
+    numbers = list(range(1, game.digits-(stop-start)+min(r, stop-start)+1))
+    results["permutations/{0}/{1}".format(size, diffculty)] = measure(
+        lambda: game.permutations(numbers, min(r, stop-start)), repeat)
+
+
+def bench_grid(results, size, diffculty, repeat):
+    """Times finding a grid, its row candidates, and moves and hints (each taken back) on it."""
+    name = "{0}/{1}".format(size, diffculty)
+    attempts = []
+    def run_find():
+        grid = game.Grid(size, diffculty, 10, seed=seed_for(size, diffculty, len(attempts)))
+        attempts.append(grid.attempts)
+        return grid
+    results["find_grid/"+name] = measure(run_find, repeat)
+    results["find_grid/"+name]["attempts"] = statistics.mean(attempts)
+    # Keep the grid with the most solutions for moves and hints.
+    grids = [game.Grid(size, diffculty, 10, seed=seed_for(size, diffculty, i)) for i in range(repeat)]
+    grid = max(grids, key=lambda grid: grid.solution_count)
+    rows = []
+    for i in range(0, size, 2):
+        numbers = [None if x == "?" else int(x) for x in grid.current_grid[i][:-1:2]]
+        runs = game.segments(len(numbers))
+        allowed = [sorted(set(range(1, game.digits+1))-set(numbers[start:stop])) for start, stop in runs]
+        if len(runs) == 1:
+            allowed, runs = allowed[0], None
+        rows.append((grid.current_grid[i][1:-1:2], numbers, grid.current_grid[i][-1], allowed, runs))
+    def run_rows():
+        for operators, numbers, total, allowed, runs in rows:
+            game.candidates(operators, numbers, total, allowed, runs)
+    results["row_candidates/"+name] = measure(run_rows, repeat)
+    random.seed(seed_for(size, diffculty))
+    moves = [random.choice(list(grid.solutions.choice().items())) for i in range(100)]
+    count = grid.solution_count
+    def run_move():
+        for (i, j), val in moves:
+            grid.try_move(i, j, val)
+            grid.undo()
+    results["try_move/"+name] = measure(run_move, repeat)
+    results["try_move/"+name]["solutions"] = count
+    def run_hint():
+        random.seed(seed_for(size, diffculty))
+        for k in range(10):
+            grid.get_hint()
+            grid.undo()
+    results["get_hint/"+name] = measure(run_hint, repeat)
+
+
+def bench_scaling(results, sizes, diffculty, repeat):
+    """Times generating grids of each size and prints how the time grows with size."""
+    print("{0:>6} {1:>12} {2:>10}".format("size", "median", "growth"), file=sys.stderr)
+    previous = None
+    for size in sizes:
+        name = "scaling/{0}/{1}".format(size, diffculty)
+        made = []
+        def run_find():
+            made.append(game.Grid(size, diffculty, 10, seed=seed_for(size, diffculty, len(made))))
+        results[name] = measure(run_find, repeat)
+        results[name]["unknown"] = statistics.mean(grid.initial_unknown for grid in made)
+        growth = results[name]["median"]/previous if previous else 1.0
+        print("{0:>6} {1:>12.6f} {2:>9.2f}x".format(size, results[name]["median"], growth), file=sys.stderr)
+        previous = results[name]["median"]
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Benchmark Functions End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# run Function Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def run(sizes, diffculties, repeat=5, scaling=False):
+    """Runs every benchmark for the given sizes and diffculties.
+
+    Args:
+        sizes (int)[]: Grid sizes to benchmark.
+        diffculties (int)[]: Levels of diffculty to benchmark.
+        repeat (int): Timings taken for each benchmark.
+        scaling (bool): Only time generating grids of each size, to see how it scales.
+
+    Returns:
+        {(string): ...}: Details of the machine and the results by benchmark name.
+
+    """
+    results = dict()
+    if scaling:
+        for diffculty in diffculties:
+            print("Generation scaling diffculty {0}".format(diffculty), file=sys.stderr)
+            bench_scaling(results, sizes, diffculty, repeat)
+        sizes = []
+    for size in sizes:
+        bench_evaluate(results, size, repeat)
+        for diffculty in diffculties:
+            print("Benchmarking {0}x{0} diffculty {1}".format(size, diffculty), file=sys.stderr)
+            bench_permutations(results, size, diffculty, repeat)
+            bench_grid(results, size, diffculty, repeat)
+    return {"python": platform.python_version(), "machine": platform.machine(),
+            "numpy": game.np is not None, "repeat": repeat, "results": results}
+
+
+def compare(old, new, threshold=0.1):
+    """Compares two runs and finds the benchmarks that got slower.
+
+    Args:
+        old {(string): ...}: Earlier run.
+        new {(string): ...}: Later run.
+        threshold (float): Ratio of the median slower that counts as a regression.
+
+    Returns:
+        ((string), (float))[]: Benchmark names and new/old median ratio of regressions.
+
+    """
+    slower = []
+    for name, result in new["results"].items():
+        if name in old["results"]:
+            ratio = result["median"]/max(old["results"][name]["median"], 1e-12)
+            print("{0:<30} {1:>12.6f} {2:>12.6f} {3:>7.2f}x".format(
+                name, old["results"][name]["median"], result["median"], ratio))
+            if ratio > 1+threshold:
+                slower.append((name, ratio))
+    return slower
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# run Function End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Main Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark generation, solving and moves.")
+    parser.add_argument("output", help="File to write the JSON results to, - for stdout.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=sorted(game.diffculty_map[1]))
+    parser.add_argument("--diffculties", type=int, nargs="+", default=sorted(game.diffculty_map))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compare", help="Earlier results to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown that counts as a regression.")
+    parser.add_argument("--scaling", action="store_true", help="Only time generation for each size.")
+    args = parser.parse_args()
+    results = run(args.sizes, args.diffculties, args.repeat, args.scaling)
+    if args.output == "-":
+        json.dump(results, sys.stdout, indent=1)
+    else:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=1)
+    if args.compare:
+        with open(args.compare) as old:
+            slower = compare(json.load(old), results, args.threshold)
+        for name, ratio in slower:
+            print("Regression: {0} is {1:.2f}x slower".format(name, ratio), file=sys.stderr)
+        sys.exit(1 if slower else 0)
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Main End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
@@ -1,10 +1,22 @@
 # /////////////////////////////////////////////////////////////////////////////////////////////////
 # Imports Start
 # /////////////////////////////////////////////////////////////////////////////////////////////////
+import array
+import collections
+import cProfile
 import random
 import copy
-import sys
+import itertools
+import math
+import multiprocessing
+import os
+import pickle
+import pstats
 import time
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Row candidates are checked one at a time without numpy.
 # /////////////////////////////////////////////////////////////////////////////////////////////////
 # Imports End
 # /////////////////////////////////////////////////////////////////////////////////////////////////
@@ -28,10 +40,31 @@ operation = {'/': lambda x, y : x // y,
             '&': lambda x, y : x & y,
             '^': lambda x, y : x ^ y,
             '|': lambda x, y : x | y}
+# Python operator for each operator in compiled equations (floor division like evaluate).
+symbols = {'/': '//', '*': '*', '%': '%', '+': '+', '-': '-', '&': '&', '^': '^', '|': '|'}
+# Operators in the order of their 3 bit codes when encoding grids.
+codes = list(order)
+# Compiled equation plans so each operator template is only compiled once,
+# the least recently used are dropped past plan_limit (about 1KB each).
+plans = collections.OrderedDict()
+plan_limit = 10000
+# Numbers in grids are 1 to digits, a run of up to digits numbers in a row has no repeats.
+digits = 9
 # How many numbers should be removed from each row for given size and diffculty
-diffculty_map = {1:{4:1,6:1,8:1,10:1,12:1,14:1,16:1,18:2},
-                2:{4:1,6:2,8:2,10:2,12:2,14:2,16:2,18:3},
-                3:{4:2,6:3,8:3,10:3,12:3,14:3,16:3,18:4}}
+# (sizes over 18 are marathon grids, rows are split into runs and more numbers are missing overall,
+# at least one more than the size before, see missing_total)
+diffculty_map = {1:{4:1,6:1,8:1,10:1,12:1,14:1,16:1,18:2,20:2,22:2,24:2,26:2,28:2,30:2,32:2},
+                2:{4:1,6:2,8:2,10:2,12:2,14:2,16:2,18:3,20:3,22:3,24:3,26:3,28:3,30:3,32:3},
+                3:{4:2,6:3,8:3,10:3,12:3,14:3,16:3,18:4,20:3,22:3,24:3,26:3,28:4,30:4,32:4}}
+# Grids larger than this have too many solutions to store or to regenerate until one fits,
+# so they are always built a missing number at a time and only counted.
+marathon_size = 18
+# Grade score bands (from Grid.grade) that play like each level of diffculty, to pass as band
+grade_bands = {1: (0.0, 2.0), 2: (2.0, 5.0), 3: (5.0, math.inf)}
+# Most grids to generate for a band before giving up on it
+band_attempts = 1000
+# Most search work allowed to find all solutions before the grid is regenerated
+solve_budget = 200000
 # Printing formats
 base_formats = {2: ["{0:<10}", "{0:<10b}", "          "],
                 8: ["{0:<5}", "{0:<5o}", "     "],
@@ -79,41 +112,1648 @@ def evaluate(e, low, high):
 # /////////////////////////////////////////////////////////////////////////////////////////////////
 
 
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# compile_equation Function Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def compile_equation(operators):
+    """Compiles an operator template into a reusable evaluation plan.
+
+    Resolves the order of the operators once, splitting on the operator that
+    would be resolved last just like evaluate, and builds a function that takes
+    the numbers of the equation and returns the answer without building strings.
+    Plans are saved in a dictionary so each template is only compiled once,
+    keeping only the plan_limit most recently used so long runs stay bounded.
+
+    Args:
+        operators (string)[]: Operators between the numbers from {/**%+-&^|}.
+
+    Returns:
+        (function): Takes (int)[] numbers and returns (int) answer.
+
+    Examples:
+        The same equation as evaluate, split into operators and numbers.
+
+        >>> plan = compile_equation("+*/%&^|")
+        >>> print(plan([1, 2, 3, 4, 5, 6, 7, 9]))
+        13
+
+    """
+    operators = tuple(operators)
+    if operators in plans:
+        plans.move_to_end(operators)
+    else:
+        def source(low, high):
+            if low == high: return "n[{0}]".format(low)  # Base case.
+            lowest = low
+            # Finds last operator to be evaluated (split point).
+            for i in range(low, high):
+                if order[operators[i]] <= order[operators[lowest]]: lowest = i
+            return "({0}{1}{2})".format(source(low, lowest), symbols[operators[lowest]],
+                                        source(lowest+1, high))
+        plans[operators] = eval("lambda n: " + source(0, len(operators)))
+        if len(plans) > plan_limit:
+            plans.popitem(last=False)
+    return plans[operators]
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# compile_equation Function End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
 # /////////////////////////////////////////////////////////////////////////////////////////////////
 # permutations Function Start
 # /////////////////////////////////////////////////////////////////////////////////////////////////
-def permutations(numbers, r):
-    """Gets a list of permutations of given numbers with limit r.
+def permutations(numbers, r):
+    """Gets a list of permutations of given numbers with limit r.
+
+    Recursivly gets the permutations of smaller limits,
+    then adds all new options to lists and returns that.
+
+    Args:
+        numbers (int)[]: Numbers options to use in permutations.
+        r (int): Limit of size of permutations.
+
+    Returns:
+        (int)[][]: List of lists containing ordered numbers.
+
+    Examples:
+        permutations of 1, 2, 3.
+
+        >>> print(permutations([1,2,3], 3))
+        [[3, 2, 1], [2, 3, 1], [3, 1, 2], [1, 3, 2], [2, 1, 3], [1, 2, 3]]
+
+    """
+    if r==1:
+        return [[i] for i in numbers]  # Base case.
+    else:
+        li = []
+        last_permutations = permutations(numbers, r-1)
+        for i in numbers:
+            for j in last_permutations:
+                if i not in j:
+                    li.append(j+[i])
+        return li
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# permutations Function End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# segments Function Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def segments(count):
+    """Splits the numbers of a row into runs that each have no repeats.
+
+    A row of up to digits numbers is one run. Longer rows (grids over 18)
+    are split into the fewest runs of at most digits numbers, as even as
+    possible, so the numbers can still only be 1 to digits.
+
+    Args:
+        count (int): Amount of numbers in the row.
+
+    Returns:
+        ((int, int))[]: Start and stop of each run.
+
+    Examples:
+        Rows of a 16x16 and a 32x32 grid.
+
+        >>> print(segments(8), segments(16))
+        [(0, 8)] [(0, 8), (8, 16)]
+
+    """
+    parts = max(1, -(-count//digits))
+    return [(count*k//parts, count*(k+1)//parts) for k in range(parts)]
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# segments Function End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# missing_total Function Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def missing_total(size, diffculty):
+    """Gets how many numbers to remove from a whole grid.
+
+    It is the amount for each row in diffculty_map times the rows. A marathon
+    grid always has at least one more than the size before it, since short runs
+    (of 5 or 6 numbers in 20x20 to 26x26 grids) leave many candidates for each
+    missing number, and only a few more numbers than in a hard 18x18 can be
+    missing and still be solved within the budget.
+
+    Args:
+        size (int): Size of the grid.
+        diffculty (int): Level of diffculty.
+
+    Returns:
+        (int): Amount of numbers to remove.
+
+    Examples:
+        Hard grids from 18x18 to 32x32.
+
+        >>> print([missing_total(size, 3) for size in range(18, 33, 2)])
+        [36, 37, 38, 39, 40, 56, 60, 64]
+
+    """
+    total = diffculty_map[diffculty][size]*(size//2)
+    if size > marathon_size:
+        total = max(total, missing_total(size-2, diffculty)+1)
+    return total
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# missing_total Function End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# missing_counts Function Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def missing_counts(size, diffculty):
+    """Gets how many numbers to remove from each row of a grid.
+
+    Every row gets the same share of missing_total, and randomly picked rows
+    get one more to make up the rest.
+
+    Args:
+        size (int): Size of the grid.
+        diffculty (int): Level of diffculty.
+
+    Returns:
+        (int)[]: Amount of numbers to remove from each row.
+
+    Examples:
+        Rows of an easy 6x6 grid and the total of a hard 20x20 grid.
+
+        >>> print(missing_counts(6, 1), sum(missing_counts(20, 3)))
+        [1, 1, 1] 37
+
+    """
+    n = size//2
+    total = missing_total(size, diffculty)
+    counts = [total//n]*n
+    for i in random.sample(range(n), total%n):
+        counts[i] += 1
+    return counts
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# missing_counts Function End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# candidates Function Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def candidates(operators, numbers, total, allowed, runs=None):
+    """Finds every way to fill the missing numbers of an equation to get the total.
+
+    Tries all permutations of the allowed numbers in the missing places.
+    When numpy is installed all permutations are built as one integer matrix
+    and the compiled equation is evaluated over the whole batch at once,
+    masking out any permutation that would divide by zero. Otherwise each
+    permutation is checked one at a time with the compiled equation.
+    A row split into runs tries every mix of the permutations of each run.
+
+    Args:
+        operators (string)[]: Operators between the numbers from {/**%+-&^|}.
+        numbers (int)[]: Numbers of the equation with None where missing.
+        total (int): Answer the equation has to equal.
+        allowed (int)[]: Numbers that can be put in the missing places (no repeats).
+        runs ((int, int))[]: Start and stop of each run without repeats, None for one run.
+            With runs, allowed has the numbers for each run ((int)[][]).
+
+    Returns:
+        ((int))[]: Values for the missing places (left to right) that give the total.
+
+    Examples:
+        A row of 4 numbers with two missing, then split into two runs.
+
+        >>> print(candidates("+*-", [1, None, 3, None], 8, [2, 4, 5]))
+        [(4, 5)]
+        >>> print(candidates("++-", [1, None, None, 3], 4, [[2, 3], [2, 3]], [(0, 2), (2, 4)]))
+        [(3, 3)]
+
+    """
+    plan = compile_equation(operators)
+    if runs is None:
+        runs, allowed = [(0, len(numbers))], [allowed]
+    missing = [[k for k in range(start, stop) if numbers[k] is None] for start, stop in runs]
+    places = sum(missing, [])
+    if not places:
+        return [()] if plan(numbers) == total else []
+    if any(len(allowed[k]) < len(missing[k]) for k in range(len(runs))):
+        return []
+    if np is None:
+        found = []
+        numbers = list(numbers)
+        options = [permutations(allowed[k], len(missing[k])) if missing[k] else [[]] for k in range(len(runs))]
+        for parts in itertools.product(*options):
+            j = sum(parts, [])
+            for k in range(len(places)):
+                numbers[places[k]] = j[k]
+            try:
+                if plan(numbers) == total:
+                    found.append(tuple(j))
+            except ZeroDivisionError:
+                pass
+        return found
+    # Build all permutations as rows of a matrix one column at a time, then mix the runs.
+    batch = np.zeros((1, 0), dtype=np.int64)
+    for k in range(len(runs)):
+        if not missing[k]:
+            continue
+        options = np.array(allowed[k], dtype=np.int64)
+        part = options.reshape(-1, 1)
+        for r in range(1, len(missing[k])):
+            pick = np.tile(options, len(part))
+            part = np.repeat(part, len(options), axis=0)
+            keep = (part != pick[:, None]).all(axis=1)
+            part = np.column_stack((part[keep], pick[keep]))
+        batch = np.column_stack((np.repeat(batch, len(part), axis=0), np.tile(part, (len(batch), 1))))
+    columns = list(numbers)
+    for k in range(len(places)):
+        columns[places[k]] = batch[:, k]
+    # Division and modulo always have a single number on the right, mask its zeros.
+    valid = np.ones(len(batch), dtype=bool)
+    for k in range(1, len(columns)):
+        if operators[k-1] in "/%":
+            if isinstance(columns[k], int):
+                if columns[k] == 0:
+                    return []
+            else:
+                valid &= columns[k] != 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        valid &= plan(columns) == total
+    return [tuple(j) for j in batch[valid].tolist()]
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# candidates Function End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# CandidateCache Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class CandidateCache:
+    """A class to remember the candidates of equations across grids.
+
+    Keeps the result of candidates for the most recently used equations,
+    keyed by the operators, the known numbers (None where missing), the
+    allowed numbers and the total. The amount of memory is bounded by the
+    amount of candidates saved, the least recently used are dropped first.
+    The cache can be saved to disk and loaded in a later run.
+
+    Args:
+        limit (int): Most candidates to keep saved.
+
+    Attributes:
+        hits (int): Lookups that were already saved.
+        misses (int): Lookups that had to be worked out.
+        size (int): Candidates saved now.
+
+    Examples:
+        The second lookup of the same row is a hit.
+
+        >>> cache = CandidateCache()
+        >>> found = cache.get("+*-", [1, None, 3, None], 8, [2, 4, 5])
+        >>> found = cache.get("+*-", [1, None, 3, None], 8, [2, 4, 5])
+        >>> print(found, cache.hits, cache.misses)
+        [(4, 5)] 1 1
+
+    """
+
+
+    def __init__(self, limit=1000000):
+        self.limit = limit
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+
+
+    def get(self, operators, numbers, total, allowed, runs=None):
+        """Gets the candidates of an equation, working them out if they are not saved.
+
+        Args:
+            operators (string)[]: Operators between the numbers from {/**%+-&^|}.
+            numbers (int)[]: Numbers of the equation with None where missing.
+            total (int): Answer the equation has to equal.
+            allowed (int)[]: Numbers that can be put in the missing places (no repeats).
+            runs ((int, int))[]: Start and stop of each run without repeats, None for one run.
+
+        Returns:
+            ((int))[]: Values for the missing places that give the total (shared, do not change).
+
+        """
+        if runs is None:
+            key = (tuple(operators), tuple(numbers), total, tuple(sorted(allowed)))
+        else:
+            key = (tuple(operators), tuple(numbers), total, tuple(tuple(sorted(k)) for k in allowed), tuple(runs))
+        found = self.entries.get(key)
+        if found is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return found
+        self.misses += 1
+        found = candidates(operators, numbers, total, allowed, runs)
+        self.entries[key] = found
+        self.size += len(found)+1
+        while self.size > self.limit and self.entries:
+            key, dropped = self.entries.popitem(last=False)
+            self.size -= len(dropped)+1
+        return found
+
+
+    def save(self, path):
+        """Saves the cache to a file."""
+        with open(path, "wb") as output:
+            pickle.dump(list(self.entries.items()), output)
+
+
+    def load(self, path):
+        """Loads a cache saved by save, keeping what is already saved."""
+        with open(path, "rb") as data:
+            for key, found in pickle.load(data):
+                if key not in self.entries:
+                    self.entries[key] = found
+                    self.entries.move_to_end(key, last=False)
+                    self.size += len(found)+1
+        while self.size > self.limit and self.entries:
+            key, dropped = self.entries.popitem(last=False)
+            self.size -= len(dropped)+1
+
+
+# Candidates shared by every grid in this process.
+candidate_cache = CandidateCache()
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# CandidateCache Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Encoding Functions Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def pack_bits(values, bits):
+    """Packs small numbers into bytes using a fixed amount of bits each.
+
+    Packs with a small running buffer, so the time is linear in the amount of numbers.
+
+    Args:
+        values (int)[]: Numbers to pack, each below 2**bits.
+        bits (int): Bits used by each number.
+
+    Returns:
+        (bytes): Packed numbers, the first in the lowest bits.
+
+    Examples:
+        Three numbers packed in 3 bits each.
+
+        >>> print(unpack_bits(pack_bits([5, 0, 7], 3), 3, 3))
+        [5, 0, 7]
+
+    """
+    if bits == 4:
+        # Two numbers a byte, the common case for digits and solutions.
+        values = list(values)+[0]*(len(values) & 1)
+        return bytes([values[i] | values[i+1] << 4 for i in range(0, len(values), 2)])
+    output = bytearray()
+    buffer = used = 0
+    for value in values:
+        buffer |= value << used
+        used += bits
+        while used >= 8:
+            output.append(buffer & 255)
+            buffer >>= 8
+            used -= 8
+    if used:
+        output.append(buffer)
+    return bytes(output)
+
+
+def unpack_bits(data, bits, count):
+    """Unpacks numbers packed by pack_bits.
+
+    Args:
+        data (bytes): Packed numbers.
+        bits (int): Bits used by each number.
+        count (int): Amount of numbers to unpack.
+
+    Returns:
+        (int)[]: Unpacked numbers.
+
+    """
+    if bits == 4:
+        values = []
+        for byte in data[:(count+1)//2]:
+            values.append(byte & 15)
+            values.append(byte >> 4)
+        return values[:count]
+    values = []
+    mask = (1 << bits)-1
+    buffer = used = 0
+    for byte in data[:(count*bits+7)//8]:
+        buffer |= byte << used
+        used += 8
+        while used >= bits and len(values) < count:
+            values.append(buffer & mask)
+            buffer >>= bits
+            used -= bits
+    return values
+
+
+def write_varint(output, value):
+    """Writes a signed int as a zigzag varint (7 bits a byte).
+
+    Args:
+        output (bytearray): Bytes to add to.
+        value (int): Number to write.
+
+    Examples:
+        Small numbers of both signs use one byte.
+
+        >>> output = bytearray()
+        >>> write_varint(output, -3); write_varint(output, 300)
+        >>> print(len(output), read_varint(output, 0), read_varint(output, 1))
+        3 (-3, 1) (300, 3)
+
+    """
+    value = value*2 if value >= 0 else -value*2-1
+    while value > 0x7f:
+        output.append(value & 0x7f | 0x80)
+        value >>= 7
+    output.append(value)
+
+
+def read_varint(data, offset):
+    """Reads a zigzag varint written by write_varint.
+
+    Args:
+        data (bytes): Bytes to read from.
+        offset (int): Place of the varint.
+
+    Returns:
+        ((int), (int)): The number and the place after it.
+
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return (value >> 1 if not value & 1 else -(value >> 1)-1), offset
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Encoding Functions End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Solver Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class Solver:
+    """A class to search the solutions of a grid one row at a time.
+
+    Assigns a valid candidate to each row from top to bottom, while keeping
+    the partly evaluated equation of every column. Columns are evaluated left
+    to right by keeping a small stack of waiting (value, operator) pairs, so the
+    state of a column only depends on the rows above. As soon as a column state
+    can no longer reach its total with the values left in the rows below, the
+    branch is cut. Whether a column state can reach its total is saved, so the
+    same state is only looked at once.
+
+    Args:
+        rows ((int))[][]: Valid candidates for the missing numbers of each row.
+        numbers (int)[][]: Numbers of each row with None where missing.
+        operators (string)[][]: Operators down each column.
+        totals (int)[]: Totals of each column.
+
+    Attributes:
+        rows (((int))[][]): Full numbers of each row for every candidate.
+        domains (int)[][][]: Values each cell can take from its row candidates.
+        reachable {((int, string)): (bool)}[][]: If each column state can reach the total, by column and row.
+        counts {(((int, string))): (int)}[]: Ways to finish from each set of column states, by row.
+        transitions {(((int, string))): ((int), (((int, string))))[]}[]: Candidates that fit
+            after each set of column states and the states after them, by row.
+        nodes (int): Amount of work done in the last search.
+        complete (bool): False if the last search ran out of budget.
+
+    Examples:
+        A 4x4 grid with one number missing from each row.
+
+        >>> solver = Solver([[(1,), (2,)], [(3,)]], [[None, 2], [3, None]], ["+", "*"], [4, 6])
+        >>> print(list(solver.iter_solutions()), solver.count())
+        [(0, 0)] 1
+
+    """
+
+
+    def __init__(self, rows, numbers, operators, totals):
+        self.size = len(numbers)
+        self.operators = operators
+        self.totals = totals
+        self.nodes = 0
+        self.complete = True
+        # Full row numbers for every candidate.
+        self.rows = []
+        for i in range(self.size):
+            missing = [j for j in range(self.size) if numbers[i][j] is None]
+            full = []
+            for candidate in rows[i]:
+                row = list(numbers[i])
+                for k in range(len(missing)):
+                    row[missing[k]] = candidate[k]
+                full.append(tuple(row))
+            self.rows.append(full)
+        self.domains = [[sorted(set(row[j] for row in self.rows[i])) for j in range(self.size)]
+                        for i in range(self.size)]
+        self.reachable = [[dict() for i in range(self.size)] for j in range(self.size)]
+        self.counts = [dict() for i in range(self.size)]
+        self.transitions = [dict() for i in range(self.size)]
+
+
+    def step(self, state, value, operator):
+        """Adds a value and the operator after it to a column state.
+
+        Resolves waiting operators that come before the new operator.
+        With no operator the column is finished and the answer is returned.
+
+        Args:
+            state ((int, string)): Waiting values and operators of the column.
+            value (int): Next value down the column.
+            operator (string): Operator after the value or None at the end.
+
+        Returns:
+            ((int, string)) or (int): New column state or the answer, None if divided by zero.
+
+        """
+        level = order[operator] if operator else 0
+        try:
+            while state and order[state[-1][1]] >= level:
+                left, last = state[-1]
+                value = operation[last](left, value)
+                state = state[:-1]
+        except ZeroDivisionError:
+            return None
+        if not operator:
+            return value
+        return state+((value, operator),)
+
+
+    def can_reach(self, column, row, state):
+        """Checks if a column state can still reach the column total.
+
+        Args:
+            column (int): Column of the state.
+            row (int): Next row to add to the column.
+            state ((int, string)): Waiting values and operators of the column.
+
+        Returns:
+            (bool): True if some values in the rows below give the total.
+
+        """
+        known = self.reachable[column][row].get(state)
+        if known is None:
+            self.nodes += 1
+            known = False
+            last = row == self.size-1
+            operator = None if last else self.operators[column][row]
+            for value in self.domains[row][column]:
+                after = self.step(state, value, operator)
+                if after is None:
+                    continue
+                if last:
+                    known = after == self.totals[column]
+                else:
+                    known = self.can_reach(column, row+1, after)
+                if known:
+                    break
+            self.reachable[column][row][state] = known
+        return known
+
+
+    def advance(self, row, states, candidate):
+        """Adds a row candidate to all the column states.
+
+        Args:
+            row (int): Row of the candidate.
+            states ((int, string))[]: State of each column before the row.
+            candidate (int)[]: Full numbers of the row.
+
+        Returns:
+            ((int, string))[]: New column states, None if a column can no longer reach its total.
+
+        """
+        last = row == self.size-1
+        after = []
+        for column in range(self.size):
+            operator = None if last else self.operators[column][row]
+            state = self.step(states[column], candidate[column], operator)
+            if state is None:
+                return None
+            if last:
+                if state != self.totals[column]:
+                    return None
+            elif not self.can_reach(column, row+1, state):
+                return None
+            after.append(state)
+        return after
+
+
+    def moves(self, row, states):
+        """Gets the candidates of a row that fit after the column states.
+
+        The moves from each set of column states are saved, so counting, sampling
+        and counting each candidate only work them out once.
+
+        Args:
+            row (int): Row of the candidates.
+            states (((int, string))): State of each column before the row.
+
+        Returns:
+            ((int), (((int, string))))[]: Index of each candidate that fits and the column states after it.
+
+        """
+        found = self.transitions[row].get(states)
+        if found is None:
+            found = []
+            for i in range(len(self.rows[row])):
+                self.nodes += 1
+                after = self.advance(row, states, self.rows[row][i])
+                if after is not None:
+                    found.append((i, tuple(after)))
+            self.transitions[row][states] = found
+        return found
+
+
+    def iter_solutions(self, budget=None, prefix=(), stop=None):
+        """Yields every solution as the candidate index used for each row.
+
+        Args:
+            budget (int): Most work to do before giving up, None for no limit.
+            prefix (int)[]: Candidate indexes of the first rows, only solutions starting with them are searched.
+            stop (function): Called every 1024 nodes, the search gives up if it returns True.
+
+        Yields:
+            (int)[]: Index of the candidate used for each row.
+
+        """
+        self.nodes = 0
+        self.complete = True
+        picks = list(prefix)+[0]*(self.size-len(prefix))
+        states = [()]*self.size
+        for row in range(len(prefix)):
+            states = self.advance(row, states, self.rows[row][prefix[row]])
+            if states is None:
+                return
+        if len(prefix) == self.size:
+            yield tuple(picks)
+            return
+        stack = [(len(prefix), states)]
+        check = 1024
+        # Depth first search, keeping the next candidate to try for each row.
+        while stack:
+            row, states = stack[-1]
+            if picks[row] == len(self.rows[row]):
+                stack.pop()
+                if stack:
+                    picks[stack[-1][0]] += 1
+                continue
+            if budget is not None and self.nodes > budget:
+                self.complete = False
+                return
+            if stop and self.nodes >= check:
+                check = self.nodes+1024
+                if stop():
+                    self.complete = False
+                    return
+            self.nodes += 1
+            after = self.advance(row, states, self.rows[row][picks[row]])
+            if after is None:
+                picks[row] += 1
+            elif row == self.size-1:
+                yield tuple(picks)
+                picks[row] += 1
+            else:
+                picks[row+1] = 0
+                stack.append((row+1, after))
+
+
+    def count_up_to(self, limit, budget=None):
+        """Counts solutions with the search, stopping as soon as there are limit of them.
+
+        Args:
+            limit (int): Amount of solutions to stop at.
+            budget (int): Most work to do before giving up, None for no limit.
+
+        Returns:
+            (int): Solutions found, at most limit (complete is True if it stopped at the limit).
+
+        """
+        found = 0
+        for picks in self.iter_solutions(budget):
+            found += 1
+            if found == limit:
+                break
+        return found
+
+
+    def count(self, budget=None):
+        """Counts the solutions without building them.
+
+        Counts how many ways the rows below can finish each set of column states,
+        and saves it. Different rows above that leave the columns in the same
+        states share the count, so the work grows with the amount of states
+        and not with the amount of solutions.
+
+        Args:
+            budget (int): Most work to do before giving up, None for no limit.
+
+        Returns:
+            (int): Amount of solutions (only correct if complete is True).
+
+        """
+        self.nodes = 0
+        self.complete = True
+        self.counts = [dict() for i in range(self.size)]
+        return self.count_from(0, ((),)*self.size, budget)
+
+
+    def count_from(self, row, states, budget=None):
+        """Counts the ways to finish a grid from the given row and column states.
+
+        Args:
+            row (int): Next row to assign.
+            states (((int, string)))): State of each column before the row.
+            budget (int): Most work to do before giving up, None for no limit.
+
+        Returns:
+            (int): Amount of ways to finish the grid.
+
+        """
+        if states in self.counts[row]:
+            return self.counts[row][states]
+        if budget is not None and self.nodes > budget:
+            self.complete = False
+            return 0
+        total = 0
+        for i, after in self.moves(row, states):
+            total += 1 if row == self.size-1 else self.count_from(row+1, after, budget)
+        if self.complete:
+            self.counts[row][states] = total
+        return total
+
+
+    def sample(self):
+        """Picks one solution uniformly at random.
+
+        Walks down the rows picking each candidate with a chance
+        proportional to the amount of solutions it leads to.
+
+        Returns:
+            (int)[]: Index of the candidate used for each row, None if there are no solutions.
+
+        """
+        states = ((),)*self.size
+        if not self.count_from(0, states):
+            return None
+        picks = []
+        for row in range(self.size):
+            k = random.randrange(self.count_from(row, states))
+            for i, after in self.moves(row, states):
+                ways = 1 if row == self.size-1 else self.count_from(row+1, after)
+                if k < ways:
+                    picks.append(i)
+                    states = after
+                    break
+                k -= ways
+        return tuple(picks)
+
+
+    def candidate_counts(self):
+        """Counts the solutions that use each candidate of each row.
+
+        Carries the ways to reach each set of column states down the rows
+        and multiplies them by the saved ways to finish from the states after
+        a candidate, so it costs about as much as counting.
+
+        Returns:
+            (int)[][]: Amount of solutions using each candidate of each row.
+
+        """
+        found = [[0]*len(candidates) for candidates in self.rows]
+        ways = {((),)*self.size: 1}
+        for row in range(self.size):
+            below = dict()
+            for states, before in ways.items():
+                for i, after in self.moves(row, states):
+                    if row == self.size-1:
+                        found[row][i] += before
+                        continue
+                    finish = self.count_from(row+1, after)
+                    if finish:
+                        found[row][i] += before*finish
+                        below[after] = below.get(after, 0)+before
+            ways = below
+        return found
+
+
+    def column_values(self, column):
+        """Finds the values each cell of a column can take with the column still reaching its total.
+
+        Walks every column state reachable from the top with the values of each
+        cell, then walks back up keeping only the values that lead to a state
+        that finishes on the total.
+
+        Args:
+            column (int): Column to check.
+
+        Returns:
+            ({(int)})[]: Values of the cell in each row that are part of a way to make the total.
+
+        """
+        last = self.size-1
+        states = {()}
+        moves = []
+        for row in range(self.size):
+            operator = None if row == last else self.operators[column][row]
+            found = []
+            after_states = set()
+            for state in states:
+                for value in self.domains[row][column]:
+                    after = self.step(state, value, operator)
+                    if after is None:
+                        continue
+                    if row == last:
+                        if after != self.totals[column]:
+                            continue
+                    elif not self.can_reach(column, row+1, after):
+                        continue
+                    found.append((state, value, after))
+                    after_states.add(after)
+            moves.append(found)
+            states = after_states
+        values = [set() for row in range(self.size)]
+        good = states
+        for row in range(last, -1, -1):
+            before = set()
+            for state, value, after in moves[row]:
+                if after in good:
+                    values[row].add(value)
+                    before.add(state)
+            good = before
+        return values
+
+
+    def propagate(self):
+        """Narrows the row candidates until the rows and columns agree.
+
+        A value stays in a cell only if the column can still reach its total
+        with it, and a row candidate stays only if all of its values stay.
+        Repeats until nothing more is removed.
+
+        Returns:
+            (Solver): Solver with only the candidates left (self if none are removed).
+
+        """
+        solver = self
+        while True:
+            columns = [solver.column_values(j) for j in range(self.size)]
+            rows = [[candidate for candidate in solver.rows[i]
+                     if all(candidate[j] in columns[j][i] for j in range(self.size))]
+                    for i in range(self.size)]
+            if all(len(rows[i]) == len(solver.rows[i]) for i in range(self.size)):
+                return solver
+            solver = copy.copy(solver)
+            solver.rows = rows
+            solver.domains = [[sorted(set(candidate[j] for candidate in rows[i])) for j in range(self.size)]
+                              for i in range(self.size)]
+            solver.reachable = [[dict() for i in range(self.size)] for j in range(self.size)]
+            solver.counts = [dict() for i in range(self.size)]
+            solver.transitions = [dict() for i in range(self.size)]
+
+
+    def fix(self, row, column, value):
+        """Makes a new solver where a cell must have the given value.
+
+        What is saved about the rows below is only about those rows, so it
+        is shared with the new solver and counting again only has to redo
+        the rows down to the fixed one.
+
+        Args:
+            row (int): Row of the cell.
+            column (int): Column of the cell.
+            value (int): Value the cell must have.
+
+        Returns:
+            (Solver): Solver with only the matching candidates in that row.
+
+        """
+        solver = copy.copy(self)
+        solver.rows = list(self.rows)
+        solver.rows[row] = [candidate for candidate in self.rows[row] if candidate[column] == value]
+        solver.domains = list(self.domains)
+        solver.domains[row] = [sorted(set(candidate[j] for candidate in solver.rows[row]))
+                               for j in range(self.size)]
+        solver.reachable = [[dict() for i in range(row+1)]+self.reachable[j][row+1:] for j in range(self.size)]
+        solver.counts = [dict() for i in range(row+1)]+self.counts[row+1:]
+        solver.transitions = [dict() for i in range(row+1)]+self.transitions[row+1:]
+        return solver
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Solver Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Solutions Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class Solutions:
+    """A class to store the solutions of a grid compactly.
+
+    Every solution is one packed row of bytes over the unknown cells.
+    For each cell and value there is a bitset (python int) of the solutions
+    that have that value in that cell, so a move is a bitwise and
+    and the count is a popcount instead of rescanning every solution.
+
+    The amount of alive solutions with each value in each cell is kept up to
+    date as moves are made, by walking only the solutions a move removed
+    (or counting the bitsets again if that is cheaper). Cells left with
+    one value are forced, so a hint is just one of them. Undoing a move
+    walks the solutions it removed back in the same way.
+
+    Args:
+        cells ((int, int))[]: Unknown cells in the order values are given.
+        values ((int))[]: Values of the cells for each solution.
+
+    Attributes:
+        cells ((int, int))[]: Unknown cells in stored order.
+        values (array): Packed values, one row of len(cells) per solution.
+        index {((int),(int)): {(int): (int)}}: Bitset of solutions for each cell and value.
+        alive (int): Bitset of solutions still possible.
+        counts (array): Alive solutions with each value in each cell, cell k value v at k*span+v.
+        sizes (array): Amount of values each cell can still take.
+        forced {((int),(int)): (int)}: Cells not moved in yet with only one value left.
+        fixed {((int),(int))}: Cells that have been moved in.
+
+    Examples:
+        Two solutions over two cells.
+
+        >>> solutions = Solutions([(0, 0), (0, 2)], [(1, 2), (2, 1)])
+        >>> print(len(solutions), solutions.domain(0, 2), solutions.forced)
+        2 {1: 1, 2: 1} {}
+        >>> print(solutions.keep(0, 0, 2), len(solutions), solutions.forced)
+        True 1 {(0, 2): 1}
+        >>> print(solutions.get(1))
+        {(0, 0): 2, (0, 2): 1}
+
+    """
+
+
+    def __init__(self, cells, values):
+        self.cells = list(cells)
+        self.values = array.array("B")
+        for solution in values:
+            self.values.extend(solution)
+        width = len(self.cells)
+        self.count = len(self.values)//width if width else 0
+        # Build the bitsets a byte at a time, shifting python ints one bit at a time is slow.
+        size = (self.count+7)//8
+        self.index = dict()
+        for k in range(width):
+            bits = dict()
+            for i, value in enumerate(self.values[k::width]):
+                if value not in bits:
+                    bits[value] = bytearray(size)
+                bits[value][i >> 3] |= 1 << (i & 7)
+            self.index[self.cells[k]] = {value: int.from_bytes(b, "little") for value, b in bits.items()}
+        self.alive = (1 << self.count)-1
+        self.positions = {cell: k for k, cell in enumerate(self.cells)}
+        self.span = max(self.values)+1 if self.count else 1
+        self.fixed = set()
+        self.recount()
+
+
+    def __len__(self):
+        return self.alive.bit_count()
+
+
+    def __iter__(self):
+        data = self.alive.to_bytes((self.count+7)//8, "little")
+        for start in range(len(data)):
+            for bit in range(8):
+                if data[start] >> bit & 1:
+                    yield self.get(start*8+bit)
+
+
+    def matching(self, row, col, val):
+        """Gets the bitset of alive solutions with the given value in the given cell.
+
+        Args:
+            row (int): Row of the cell.
+            col (int): Column of the cell.
+            val (int): Value in the cell.
+
+        Returns:
+            (int): Bitset of the matching solutions.
+
+        """
+        if (row, col) not in self.index:
+            return 0
+        return self.alive & self.index[(row, col)].get(val, 0)
+
+
+    def keep(self, row, col, val):
+        """Keeps only the solutions with the given value in the given cell.
+
+        Args:
+            row (int): Row of the cell.
+            col (int): Column of the cell.
+            val (int): Value in the cell.
+
+        Returns:
+            (bool): False if no solutions match, and nothing is removed.
+
+        """
+        matching = self.matching(row, col, val)
+        if not matching:
+            return False
+        self.fixed.add((row, col))
+        self.forced.pop((row, col), None)
+        self.set_alive(matching)
+        return True
+
+
+    def state(self):
+        """Gets the moves made so far, to go back to with restore.
+
+        The alive bitset is never changed in place, so states share it.
+
+        Returns:
+            ((int), {((int),(int))}): Alive bitset and cells moved in.
+
+        """
+        return (self.alive, frozenset(self.fixed))
+
+
+    def restore(self, state):
+        """Goes back to a state, only looking at the solutions that change.
+
+        Args:
+            state ((int), {((int),(int))}): State from the state method.
+
+        """
+        alive, fixed = state
+        changed = self.fixed ^ fixed
+        self.fixed = set(fixed)
+        self.set_alive(alive)
+        for cell in changed:
+            self.refresh(self.positions[cell])
+
+
+    def branch(self):
+        """Makes a copy to make other moves in, sharing the stored solutions and bitsets.
+
+        Returns:
+            (Solutions): Copy with its own counts and moves.
+
+        """
+        solutions = copy.copy(self)
+        solutions.counts = self.counts[:]
+        solutions.sizes = self.sizes[:]
+        solutions.forced = dict(self.forced)
+        solutions.fixed = set(self.fixed)
+        return solutions
+
+
+    def set_alive(self, alive):
+        """Changes the alive solutions and updates the counts.
+
+        Args:
+            alive (int): Bitset of the solutions now possible.
+
+        """
+        removed = self.alive & ~alive
+        added = alive & ~self.alive
+        self.alive = alive
+        # Walking a changed solution costs about as much as popcounting 2KB of every bitset.
+        if removed.bit_count()+added.bit_count() > self.span*(self.count >> 14)+16:
+            self.recount()
+            return
+        if removed:
+            self.adjust(removed, -1)
+        if added:
+            self.adjust(added, 1)
+
+
+    def recount(self):
+        """Counts the alive solutions with each value in each cell from the bitsets."""
+        width = len(self.cells)
+        self.counts = array.array("I", bytes(4*width*self.span))
+        self.sizes = array.array("I", bytes(4*width))
+        self.forced = dict()
+        for k, cell in enumerate(self.cells):
+            for value, bits in self.index[cell].items():
+                count = (bits & self.alive).bit_count()
+                if count:
+                    self.counts[k*self.span+value] = count
+                    self.sizes[k] += 1
+            self.refresh(k)
+
+
+    def adjust(self, changed, step):
+        """Adds or takes solutions out of the counts, only looking at the changed ones.
+
+        Args:
+            changed (int): Bitset of the solutions that were added or removed.
+            step (int): 1 if they were added, -1 if they were removed.
+
+        """
+        width = len(self.cells)
+        span = self.span
+        counts, sizes, values = self.counts, self.sizes, self.values
+        touched = []
+        data = memoryview(changed.to_bytes((self.count+63)//64*8, "little")).cast("Q")
+        for start in range(len(data)):
+            word = data[start]
+            while word:
+                low = word & -word
+                word ^= low
+                i = (start*64+low.bit_length()-1)*width
+                solution = values[i:i+width]
+                for k in range(width):
+                    j = k*span+solution[k]
+                    counts[j] += step
+                    # A value appeared in or left the cell.
+                    if counts[j] == (step > 0):
+                        sizes[k] += step
+                        touched.append(k)
+        for k in touched:
+            self.refresh(k)
+
+
+    def refresh(self, k):
+        """Updates if a cell is forced from its counts.
+
+        Args:
+            k (int): Position of the cell.
+
+        """
+        cell = self.cells[k]
+        if self.sizes[k] == 1 and cell not in self.fixed:
+            self.forced[cell] = next(v for v in range(self.span) if self.counts[k*self.span+v])
+        else:
+            self.forced.pop(cell, None)
+
+
+    def domain(self, row, col):
+        """Gets the values a cell can take and the amount of alive solutions with each.
+
+        Args:
+            row (int): Row of the cell.
+            col (int): Column of the cell.
+
+        Returns:
+            {(int): (int)}: Amount of solutions for each value, empty if the cell is not unknown.
+
+        """
+        k = self.positions.get((row, col))
+        if k is None:
+            return dict()
+        return {value: self.counts[k*self.span+value] for value in sorted(self.index[(row, col)])
+                if self.counts[k*self.span+value]}
+
+
+    def get(self, i):
+        """Gets a solution by its stored index.
+
+        Args:
+            i (int): Index of the solution.
+
+        Returns:
+            {((int),(int)): (int)}: Value of each unknown cell.
+
+        """
+        width = len(self.cells)
+        return dict(zip(self.cells, self.values[i*width:(i+1)*width]))
+
+
+    def choice(self):
+        """Gets a random alive solution.
+
+        Returns:
+            {((int),(int)): (int)}: Value of each unknown cell.
+
+        """
+        k = random.randrange(len(self))
+        data = self.alive.to_bytes((self.count+7)//8, "little")
+        # Skip whole words until the word holding the k-th alive solution.
+        for start in range(0, len(data), 8):
+            word = int.from_bytes(data[start:start+8], "little")
+            if k < word.bit_count():
+                break
+            k -= word.bit_count()
+        for bit in range(64):
+            if word >> bit & 1:
+                if k == 0:
+                    return self.get(start*8+bit)
+                k -= 1
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Solutions Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# LazySolutions Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class LazySolutions:
+    """A class to use the solutions of a grid without building them.
+
+    Works the same as Solutions but keeps a Solver instead of the solutions.
+    The count comes from counting the solver and random solutions are
+    sampled uniformly from it, so a grid with a large solution space
+    does not need memory for every solution. The values of each cell are
+    counted from the solutions using each row candidate after every move.
+
+    Args:
+        solver (Solver): Counted solver of the grid.
+        cells ((int, int))[]: Unknown cells of the grid.
+
+    Attributes:
+        solver (Solver): Solver with the moves made so far fixed.
+        cells ((int, int))[]: Unknown cells of the grid.
+        count (int): Amount of solutions still possible.
+        domains {((int),(int)): {(int): (int)}}: Alive solutions with each value in each cell.
+        forced {((int),(int)): (int)}: Cells not moved in yet with only one value left.
+        fixed {((int),(int))}: Cells that have been moved in.
+
+    """
+
+
+    def __init__(self, solver, cells):
+        self.solver = solver
+        self.cells = list(cells)
+        self.count = solver.count_from(0, ((),)*solver.size)
+        self.fixed = set()
+        self.recount()
+
+
+    def __len__(self):
+        return self.count
+
+
+    def __iter__(self):
+        for picks in self.solver.iter_solutions():
+            yield self.get(picks)
+
+
+    def keep(self, row, col, val):
+        """Keeps only the solutions with the given value in the given cell.
+
+        Args:
+            row (int): Row of the cell.
+            col (int): Column of the cell.
+            val (int): Value in the cell.
+
+        Returns:
+            (bool): False if no solutions match, and nothing is removed.
+
+        """
+        if (row, col) not in self.cells:
+            return False
+        # The fixed solver keeps what was counted for the rows below the move,
+        # and counting each candidate also counts the solutions.
+        solver = self.solver.fix(row//2, col//2, val)
+        found = solver.candidate_counts()
+        count = sum(found[0])
+        if not count:
+            return False
+        self.solver = solver
+        self.count = count
+        self.fixed.add((row, col))
+        self.recount(found)
+        return True
+
+
+    def state(self):
+        """Gets the moves made so far, to go back to with restore.
+
+        A move makes a new solver, domains and forced cells instead of changing
+        them, so states share them.
+
+        Returns:
+            ((Solver), (int), {...}, {...}, {((int),(int))}): Solver, count, domains, forced and cells moved in.
+
+        """
+        return (self.solver, self.count, self.domains, self.forced, frozenset(self.fixed))
+
+
+    def restore(self, state):
+        """Goes back to a state.
+
+        Args:
+            state ((Solver), (int), {...}, {...}, {((int),(int))}): State from the state method.
+
+        """
+        self.solver, self.count, self.domains, self.forced, fixed = state
+        self.fixed = set(fixed)
+
+
+    def branch(self):
+        """Makes a copy to make other moves in, sharing the solver.
+
+        Returns:
+            (LazySolutions): Copy with its own moves.
+
+        """
+        solutions = copy.copy(self)
+        solutions.fixed = set(self.fixed)
+        return solutions
+
+
+    def recount(self, found=None):
+        """Counts the alive solutions with each value in each cell from the row candidates.
+
+        Args:
+            found (int)[][]: Solutions using each candidate from candidate_counts, None to count them.
+
+        """
+        if found is None:
+            found = self.solver.candidate_counts()
+        self.domains = {cell: dict() for cell in self.cells}
+        for i, j in self.cells:
+            domain = self.domains[(i, j)]
+            for candidate, count in zip(self.solver.rows[i//2], found[i//2]):
+                if count:
+                    domain[candidate[j//2]] = domain.get(candidate[j//2], 0)+count
+        self.forced = {cell: next(iter(domain)) for cell, domain in self.domains.items()
+                       if len(domain) == 1 and cell not in self.fixed}
+
+
+    def domain(self, row, col):
+        """Gets the values a cell can take and the amount of alive solutions with each.
+
+        Args:
+            row (int): Row of the cell.
+            col (int): Column of the cell.
+
+        Returns:
+            {(int): (int)}: Amount of solutions for each value, empty if the cell is not unknown.
+
+        """
+        return dict(sorted(self.domains.get((row, col), dict()).items()))
+
+
+    def get(self, picks):
+        """Gets the values of the unknown cells for a solution.
+
+        Args:
+            picks (int)[]: Index of the candidate used for each row.
+
+        Returns:
+            {((int),(int)): (int)}: Value of each unknown cell.
+
+        """
+        return {(i, j): self.solver.rows[i//2][picks[i//2]][j//2] for i, j in self.cells}
+
+
+    def choice(self):
+        """Gets a uniformly random solution.
+
+        Returns:
+            {((int),(int)): (int)}: Value of each unknown cell.
+
+        """
+        return self.get(self.solver.sample())
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# LazySolutions Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Parallel Solving Functions Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Shared counters of a worker process and the last solver it was sent, set when the worker starts.
+worker_state = None
+
+
+def start_worker(found, nodes):
+    """Keeps the shared counters in a worker so they are only sent once."""
+    global worker_state
+    worker_state = {"found": found, "nodes": nodes, "key": None, "solver": None}
 
-    Recursivly gets the permutations of smaller limits,
-    then adds all new options to lists and returns that.
+
+def solve_part(task):
+    """Finds the solutions starting with a prefix of row candidates in a worker.
+
+    The solver is only unpickled when the task is for a different search than
+    the last one. Adds its work to the shared node count every 1024 nodes and
+    gives up when the shared budget is spent or enough solutions have been found.
 
     Args:
-        numbers (int)[]: Numbers options to use in permutations.
-        r (int): Limit of size of permutations.
+        task ((int), (bytes), (int), (int), (int)[]): Key of the search, pickled solver,
+            limit of solutions, budget and candidate indexes of the first rows.
 
     Returns:
-        (int)[][]: List of lists containing ordered numbers.
+        ((int)[][], (bool)): Solutions found and if the part was searched completely.
+
+    """
+    key, data, limit, budget, prefix = task
+    found, nodes = worker_state["found"], worker_state["nodes"]
+    if worker_state["key"] != key:
+        worker_state["key"] = key
+        worker_state["solver"] = pickle.loads(data)
+    solver = worker_state["solver"]
+    counted = [0]
+    def stop():
+        with nodes.get_lock():
+            nodes.value += solver.nodes-counted[0]
+            total = nodes.value
+        counted[0] = solver.nodes
+        return (budget is not None and total > budget) or (limit is not None and found.value >= limit)
+    if stop():
+        return [], False
+    picks = []
+    for solution in solver.iter_solutions(None, prefix, stop):
+        picks.append(solution)
+        with found.get_lock():
+            found.value += 1
+        if limit is not None and found.value >= limit:
+            break
+    stop()
+    return picks, solver.complete
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Parallel Solving Functions End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# SolverPool Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class SolverPool:
+    """A class to find the solutions of solvers across a pool of processes.
+
+    The processes are started once and kept for every search, so a grid that
+    is generated many times only starts them once. Each search splits on the
+    candidate of the first row (and the second row if the first has too few
+    candidates to keep every process busy). The solver is pickled once for the
+    search and sent with chunks of prefixes, and every process shares the count
+    of solutions and nodes, so they all stop as soon as the limit of solutions
+    is found or the budget is spent.
+
+    Args:
+        workers (int): Amount of processes, None for every core.
+
+    Attributes:
+        workers (int): Amount of processes.
+        found (multiprocessing.Value): Solutions found by every process in the current search.
+        nodes (multiprocessing.Value): Nodes searched by every process in the current search.
+        searches (int): Searches done, the key that tells processes a solver is new.
+        pool (multiprocessing.Pool): Processes doing the searches.
+
+    """
+
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self.found = multiprocessing.Value("q", 0)
+        self.nodes = multiprocessing.Value("q", 0)
+        self.searches = 0
+        self.pool = multiprocessing.Pool(self.workers, start_worker, (self.found, self.nodes))
+
+
+    def solutions(self, solver, limit=None, budget=None):
+        """Finds the solutions of a solver.
+
+        Sets the nodes searched by every process and if the need was met
+        on the solver, like iter_solutions does.
+
+        Args:
+            solver (Solver): Solver of the grid.
+            limit (int): Stop after this many solutions, None for all of them.
+            budget (int): Most work to do across every process, None for no limit.
+
+        Returns:
+            (int)[][]: Solutions in search order (the first limit of them).
+
+        """
+        prefixes = [(i,) for i in range(len(solver.rows[0]))]
+        if len(prefixes) < self.workers*4 and solver.size > 1:
+            prefixes = [(i, j) for i in range(len(solver.rows[0])) for j in range(len(solver.rows[1]))]
+        self.searches += 1
+        self.found.value = 0
+        self.nodes.value = 0
+        data = pickle.dumps(solver)
+        tasks = [(self.searches, data, limit, budget, prefix) for prefix in prefixes]
+        found = []
+        complete = True
+        # Every part is waited for, so no process is still on this search when the next one starts.
+        for picks, done in self.pool.imap_unordered(solve_part, tasks, max(1, len(tasks)//(self.workers*4))):
+            found.extend(picks)
+            complete = complete and done
+        solver.nodes = self.nodes.value
+        solver.complete = complete or (limit is not None and len(found) >= limit)
+        return sorted(found)[:limit]
+
+
+    def close(self):
+        """Stops the processes."""
+        self.pool.close()
+        self.pool.join()
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# SolverPool Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Metrics Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class Metrics:
+    """A class to collect what happens while grids are generated.
+
+    Given to a Grid, it gets a record for every attempt at making a grid and a
+    summary of every grid. Grids without metrics skip all of this, so it costs
+    nothing when not used. The same metrics can be shared by many grids.
+
+    Args:
+        on_attempt (function): Called with the record of each attempt.
+        on_grid (function): Called with the summary of each finished grid.
+        profile (bool): Profile the generation of the next grid with cProfile.
+
+    Attributes:
+        attempts {(string): ...}[]: Records of the attempts for the last grid.
+        summary {(string): ...}: Summary of the last grid.
+        stats (pstats.Stats): Profile of the last profiled grid.
 
     Examples:
-        permutations of 1, 2, 3.
+        Collecting how many grids were made and why they were rejected.
 
-        >>> print(permutations([1,2,3], 3))
-        [[3, 2, 1], [2, 3, 1], [3, 1, 2], [1, 3, 2], [2, 1, 3], [1, 2, 3]]
+        >>> metrics = Metrics()
+        >>> grid = Grid(8, 3, 10, metrics=metrics)
+        >>> print(metrics.summary["attempts"] == grid.attempts, sorted(metrics.summary["rejected"]))
+        True ['no solutions', 'not unique', 'out of band', 'over budget']
 
     """
-    if r==1:
-        return [[i] for i in numbers]  # Base case.
-    else:
-        li = []
-        last_permutations = permutations(numbers, r-1)
-        for i in numbers:
-            for j in last_permutations:
-                if i not in j:
-                    li.append(j+[i])
-        return li
+
+
+    def __init__(self, on_attempt=None, on_grid=None, profile=False):
+        self.on_attempt = on_attempt
+        self.on_grid = on_grid
+        self.profile = profile
+        self.attempts = []
+        self.summary = None
+        self.stats = None
+        self.profiler = None
+
+
+    def begin(self, grid):
+        """Starts collecting for a new grid."""
+        self.attempts = []
+        self.start = time.perf_counter()
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+
+    def attempt(self):
+        """Makes the record for a new attempt.
+
+        Returns:
+            {(string): ...}: Record for get_solutions to fill in.
+
+        """
+        return {"attempt": len(self.attempts)+1, "accepted": False, "reason": None,
+                "row_candidates": [], "state_space": 0, "evaluations": 0, "nodes": 0, "grade": None,
+                "times": {"generate": 0.0, "grade": 0.0, "rows": 0.0, "solve": 0.0}}
+
+
+    def end_attempt(self, record, accepted):
+        """Saves the record of a finished attempt."""
+        record["accepted"] = accepted
+        self.attempts.append(record)
+        if self.on_attempt:
+            self.on_attempt(record)
+
+
+    def end(self, grid):
+        """Finishes collecting for a grid and makes its summary."""
+        if self.profiler:
+            self.profiler.disable()
+            self.stats = pstats.Stats(self.profiler)
+            self.profiler = None
+            self.profile = False
+        rejected = {"no solutions": 0, "over budget": 0, "not unique": 0, "out of band": 0}
+        for record in self.attempts:
+            if record["reason"]:
+                rejected[record["reason"]] += 1
+        self.summary = {"size": grid.size, "diffculty": grid.diffculty, "attempts": len(self.attempts),
+                        "rejected": rejected, "time": time.perf_counter()-self.start,
+                        "times": {phase: sum(record["times"][phase] for record in self.attempts)
+                                  for phase in ("generate", "grade", "rows", "solve")},
+                        "evaluations": sum(record["evaluations"] for record in self.attempts),
+                        "nodes": sum(record["nodes"] for record in self.attempts),
+                        "solutions": grid.solution_count}
+        if self.on_grid:
+            self.on_grid(self.summary)
 # /////////////////////////////////////////////////////////////////////////////////////////////////
-# permutations Function End
+# Metrics Class End
 # /////////////////////////////////////////////////////////////////////////////////////////////////
 
 
@@ -130,21 +1770,45 @@ class Grid:
     numbers to look at it regenerates the grid.
 
     Args:
-        size (int): Grid size in range (4,6,8,10,12,14,16,18).
+        size (int): Grid size in range (4,6,...,32), over 18 is always lazy and constructive.
         diffculty (int): Level of diffculty (1,2,3).
         base (int): Number base representation for output.
+        lazy (bool): Only count the solutions instead of storing them all.
+        seed (int): Seed for the random generator so the grid can be made again.
+        metrics (Metrics): Collects how the grid was generated, None to not collect.
+        constructive (bool): Build the grid a missing number at a time instead of regenerating it.
+        unique (bool): Only make grids with exactly one solution (built a missing number at a time).
+        workers (int): Processes to split the search for solutions across, None to search here.
+        band ((float), (float)): Lowest and highest grade score to accept, None to not grade
+            (not with unique, unique grids are nearly all solved by propagation and score 0).
+
+    Raises:
+        ValueError: If unique grids are asked for in a band, or no grid is in the band
+            within band_attempts.
 
     Attributes:
         Defaults:
             size (int): Grid size.
             diffculty (int): Level of diffculty.
             base (int): Base representation.
+            lazy (bool): Solutions are counted and sampled on demand.
+            seed (int): Seed the grid was generated with.
+            metrics (Metrics): Collects how the grid was generated.
+            constructive (bool): Grids are built a missing number at a time.
+            unique (bool): Grids have exactly one solution.
+            workers (int): Processes the search for solutions is split across.
+            pool (SolverPool): Processes searching while the grid is found, None otherwise.
+            band ((float), (float)): Grade scores grids are accepted in.
             state (string): State the grid is in.
         Grid:
-            solutions [[{((int),(int)): (int)}]]: Grid solutions representation.
+            solutions (Solutions|LazySolutions): Grid solutions representation.
+            attempts (int): Grids generated before one was accepted.
+            rating {(string): ...}: Grade of the grid from grade, None if it was not graded.
             current_grid (string)[][]: Current grid representation.
-            grid (string)[][]: Temp grid for validation and testing.
             missing
+        Moves:
+            history ((int), (int), ...)[]: Row, column and solutions state before each move.
+            undone ((int), (int), (int))[]: Row, column and value of moves taken back, to redo.
         Score:
             start_time (float): Time game was started.
             initial_solutions (int): Count of solutions at start.
@@ -166,13 +1830,28 @@ class Grid:
     """
 
 
-    def __init__(self, size, diffculty, base):
+    def __init__(self, size, diffculty, base, lazy=False, seed=None, metrics=None, constructive=False,
+                 unique=False, workers=None, band=None):
+        if unique and band:
+            raise ValueError("Unique grids cannot be graded into a band")
         self.size = size
         self.diffculty = diffculty
         self.base = base
+        self.lazy = lazy or size > marathon_size
+        self.seed = seed
+        self.metrics = metrics
+        self.constructive = constructive or size > marathon_size
+        self.unique = unique
+        self.workers = workers
+        self.pool = None
+        self.band = band
+        self.rating = None
         self.state = "start"
+        if seed is not None:
+            random.seed(seed)
         # Generated Variables
-        self.solutions = []
+        self.solutions = None
+        self.row_cache = dict()
         self.find_grid()
         # Score variables
         self.start_time = time.time()
@@ -180,134 +1859,350 @@ class Grid:
         self.initial_unknown = self.unknown
         self.hints = 0
         self.badmoves = 0
+        self.history = []
+        self.undone = []
+
+
+    @classmethod
+    def from_dict(cls, puzzle, base=None, lazy=False):
+        """Makes a grid from a saved puzzle instead of generating one.
+
+        Args:
+            puzzle {(string): ...}: Puzzle from to_dict (solutions are found again if not saved).
+            base (int): Number base representation for output, None for the saved base.
+            lazy (bool): Only count the solutions if they have to be found again.
+
+        Returns:
+            (Grid): Grid ready to play.
+
+        Raises:
+            ValueError: If the solutions have to be found again and there are none (or too many to search).
+
+        """
+        grid = cls.__new__(cls)
+        grid.size = puzzle["size"]
+        grid.diffculty = puzzle["diffculty"]
+        grid.base = base or puzzle["base"]
+        grid.lazy = lazy or puzzle.get("lazy", False) or grid.size > marathon_size
+        grid.seed = puzzle.get("seed")
+        grid.metrics = None
+        grid.constructive = puzzle.get("constructive", False)
+        grid.unique = puzzle.get("unique", False)
+        grid.workers = None
+        grid.pool = None
+        grid.band = tuple(puzzle["band"]) if puzzle.get("band") else None
+        grid.rating = None
+        grid.row_cache = dict()
+        grid.state = "start"
+        grid.current_grid = [list(row) for row in puzzle["grid"]]
+        grid.attempts = 0
+        grid.missing = dict()
+        grid.unknown = 0
+        for i in range(0, grid.size, 2):
+            grid.missing[i] = [j for j in range(0, grid.size, 2) if grid.current_grid[i][j] == "?"]
+            grid.unknown += len(grid.missing[i])
+        if "solutions" in puzzle:
+            cells = [tuple(cell) for cell in puzzle["cells"]]
+            grid.solutions = Solutions(cells, puzzle["solutions"])
+            grid.solution_count = len(grid.solutions)
+            grid.create_time = time.process_time()
+        elif not grid.get_solutions():
+            raise ValueError("Puzzle has no solutions or is too large to solve")
+        # Score variables
+        grid.start_time = time.time()
+        grid.initial_solutions = grid.solution_count
+        grid.initial_unknown = grid.unknown
+        grid.hints = 0
+        grid.badmoves = 0
+        grid.history = []
+        grid.undone = []
+        return grid
 
 
     def find_grid(self):
         """Finds a grid to start with.
 
         Keeps making grid until there is a grid with a small enough state space.
+        With a band each grid is graded first, and only searched if its grade is
+        in the band. Counts how many grids were made in attempts, and tells the
+        metrics about every attempt when there are metrics. With workers one pool
+        of processes searches for every attempt and is stopped at the end.
+
+        Raises:
+            ValueError: If no grid is in the band within band_attempts.
+
+        """
+        if self.metrics:
+            self.metrics.begin(self)
+        self.attempts = 0
+        accepted = False
+        if self.workers:
+            self.pool = SolverPool(self.workers)
+        try:
+            while not accepted:
+                if self.band and self.attempts == band_attempts:
+                    raise ValueError("No grid in band {0} within {1} attempts".format(self.band, band_attempts))
+                self.attempts += 1
+                record = self.metrics.attempt() if self.metrics else None
+                start = time.perf_counter()
+                # Grid to display.
+                if self.constructive or self.unique:
+                    self.current_grid = self.build_grid(self.size, self.diffculty, record)
+                else:
+                    self.current_grid = self.gen_grid(self.size, self.diffculty)
+                if record:
+                    record["times"]["generate"] = time.perf_counter()-start
+                if self.current_grid is None:
+                    if record:
+                        record["reason"] = "over budget"
+                    accepted = False
+                elif self.band and not self.in_band(record):
+                    accepted = False
+                else:
+                    accepted = self.get_solutions(record)
+                if record:
+                    self.metrics.end_attempt(record, accepted)
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool = None
+        if self.metrics:
+            self.metrics.end(self)
+
+
+    def grade(self):
+        """Grades how hard the current grid is with a propagation solver.
+
+        Counts the unknown cells that the row candidates alone leave with one
+        value, then narrows the rows and columns against each other until they
+        agree and counts the cells forced after that. Whatever is left has to be
+        searched, so the solutions of the narrowed rows are counted to get the
+        search nodes and the effective branching factor per row. The score is
+        the log of the nodes times the share of unknown cells not forced.
+
+        Returns:
+            {(string): ...}: Unknown cells, cells forced by rows and then columns, solutions,
+                search nodes, branching factor, score (higher is harder) and if the search finished.
+
+        """
+        solver, row_solutions = self.make_solver()
+        cells = [(i//2, j//2) for i in range(0, self.size, 2) for j in range(0, self.size, 2)
+                 if self.current_grid[i][j] == "?"]
+        rating = {"unknown": len(cells), "rows": 0, "columns": 0, "solutions": 0, "nodes": 0,
+                  "branching": 0.0, "score": 0.0, "complete": True}
+        if solver is None:
+            return rating
+        rating["rows"] = sum(len(solver.domains[i][j]) == 1 for i, j in cells)
+        solver = solver.propagate()
+        forced = sum(len(solver.domains[i][j]) == 1 for i, j in cells)
+        rating["columns"] = forced-rating["rows"]
+        rating["solutions"] = solver.count(solve_budget)
+        rating["complete"] = solver.complete
+        rating["nodes"] = solver.nodes
+        rating["branching"] = max(solver.nodes, 1)**(2/self.size)
+        rating["score"] = math.log2(max(solver.nodes, 1))*(len(cells)-forced)/max(len(cells), 1)
+        return rating
+
+
+    def in_band(self, record=None):
+        """Grades the current grid and checks if it is in the band.
+
+        Args:
+            record {(string): ...}: Metrics record of the attempt to fill in, None to not record.
+
+        Returns:
+            (bool): True if the grid has solutions found within budget and a score in the band.
 
         """
-        # Grid to display.
-        self.current_grid = self.gen_grid(self.size, self.diffculty)
-        # Temp grid to check solutions with.
-        self.grid = copy.deepcopy(self.current_grid)
-        while not self.get_solutions():
-            self.current_grid = self.gen_grid(self.size, self.diffculty)
-            self.grid = copy.deepcopy(self.current_grid)
+        start = time.perf_counter()
+        self.rating = self.grade()
+        if record:
+            record["grade"] = self.rating
+            record["times"]["grade"] = time.perf_counter()-start
+        if not self.rating["complete"] or not self.rating["solutions"]:
+            if record:
+                record["reason"] = "over budget" if not self.rating["complete"] else "no solutions"
+            return False
+        if not self.band[0] <= self.rating["score"] <= self.band[1]:
+            if record:
+                record["reason"] = "out of band"
+            return False
+        return True
 
 
-    def get_solutions(self):
+    def get_solutions(self, record=None):
         """Finds all possible solutions to a grid.
 
-        Finds all valid (using evaluate function) number combinations for each row.
-        Then using all combinations of rows find all ones where columns are valid.
+        Finds all valid (using compiled equations) number combinations for each row.
+        Then searches row by row for combinations where the columns are valid,
+        cutting a branch as soon as a column can no longer reach its total.
         Store all solutions and time it finished.
 
+        Args:
+            record {(string): ...}: Metrics record of the attempt to fill in, None to not record.
+
         Returns:
-            (bool): False if state space is too large and True if solutions are found.
+            (bool): False if the search is too large or broken and True if solutions are found.
 
         """
-        # Gets the row possibles to check
-        row_possibles = []
-        for i in range(self.size//2):
-            numbers = list(set([str(x) for x in range(1, 10)])-set(self.current_grid[i*2][:-1]))
-            row_possibles.append(permutations(numbers, diffculty_map[self.diffculty][self.size]))
-        # Find valid row permutations.
-        row_solutions = [[] for i in range(self.size//2)]
-        for i in range(0, self.size, 2):
-            for j in row_possibles[i//2]:
-                entry = dict()
-                for k in range(len(self.missing[i])):
-                    self.grid[i][self.missing[i][k]] = j[k]
-                    entry[(i, self.missing[i][k])] = j[k]
-                if self.grid[i][-1] == evaluate("".join(self.grid[i][:-1]), 0, self.size-2):
-                    row_solutions[i//2].append(entry)
-        # Checks how big the state space would be with this grid.
-        state_space = 1
-        for i in row_solutions:
-            state_space *= len(i)
-        print(state_space)
-        # if the state space is broken or too large regenerate grid.
-        # Generates a grid a lot quicker than search for all solutions
-        if state_space > 50000 or state_space == 0:
+        start = time.perf_counter()
+        solver, row_solutions = self.make_solver(record)
+        if record:
+            record["times"]["rows"] = time.perf_counter()-start
+        if solver is None:
+            if record:
+                record["reason"] = "no solutions"
+            return False
+        start = time.perf_counter()
+        # searchs row by row for rows that lead to a solution, giving up when over budget
+        cells = [(i, j) for i in range(0, self.size, 2) for j in sorted(self.missing[i])]
+        if self.lazy:
+            # Only count the solutions, they are sampled when needed.
+            solver.count(solve_budget)
+            if solver.complete:
+                self.solutions = LazySolutions(solver, cells)
+        else:
+            # Unique grids only need to know if there is a second solution.
+            limit = 2 if self.unique else None
+            if self.pool:
+                # Split the search across processes.
+                found = self.pool.solutions(solver, limit, solve_budget)
+            else:
+                found = itertools.islice(solver.iter_solutions(solve_budget), limit)
+            self.solutions = Solutions(cells, (sum([row_solutions[i][picks[i]] for i in range(len(picks))], ())
+                                               for picks in found))
+        if record:
+            record["times"]["solve"] = time.perf_counter()-start
+            record["nodes"] += solver.nodes
+        if not solver.complete:
+            if record:
+                record["reason"] = "over budget"
+            return False
+        self.solution_count = len(self.solutions)
+        if self.solution_count == 0:
+            if record:
+                record["reason"] = "no solutions"
+            return False
+        if self.unique and self.solution_count > 1:
+            if record:
+                record["reason"] = "not unique"
             return False
-        # searchs for rows that lead to a solution (brute force)
-        rows = [0 for x in range(len(row_solutions))]
-        while rows:
-            rows = self.check(row_solutions, rows)
         self.create_time = time.process_time()
         return True
 
 
-    def check(self, row_solutions, rows):
-        """Checks the row solutions given with indexs given.
+    def row_candidates(self, i, record=None):
+        """Gets the valid candidates for the missing numbers of a row.
 
-        Checks the cobination of row_solutions given, and adds it to solutions if valid.
-        Then returns a new set of indexs if it has more to check. This stops recursive depth
-        becoming too large. Returns False when the last solution has been checked.
+        The candidates of each row are saved with the row they were found for,
+        so they are only looked up again when the row changes, and the lookup
+        goes through the candidate cache shared by every grid. Evaluations are only
+        counted when the candidate cache did not have the row.
 
         Args:
-            row_solutions [[{((int),(int)): (int)}]]: List of valid solutions for each row.
-            row (int)[]: Combination of indexs to check.
+            i (int): Row of the grid.
+            record {(string): ...}: Metrics record to count evaluations in, None to not record.
 
         Returns:
-            (int)[]: Next combination of rows to check.
+            ((int)[], ((int))[]): Numbers of the row (None where missing) and its candidates.
 
         """
-        # if at the end of the brute force stop the loop
-        if rows[-1] == len(row_solutions[-1]):
-             return False
-        solution = dict()
-        # try the combination of row solutions given by rows
-        for i in range(len(rows)):
-            solution = {**solution, **row_solutions[i][rows[i]]}
-        # Check that columns are valid, then add the combination to the solutions
-        if self.check_columns(solution):
-            self.solutions.append(solution)
-            self.solution_count += 1
-        # change the cycle of the rows
-        rows[0] += 1
-        for i in range(len(rows)-1):
-            if rows[i] == len(row_solutions[i]):
-                rows[i] = 0
-                rows[i+1] += 1
-        return rows
+        row = tuple(self.current_grid[i])
+        saved = self.row_cache.get(i)
+        if saved is None or saved[0] != row:
+            numbers = [None if x == "?" else int(x) for x in row[:-1:2]]
+            runs = segments(len(numbers))
+            allowed = [sorted(set(range(1, digits+1))-set(numbers[start:stop])) for start, stop in runs]
+            misses = candidate_cache.misses
+            if len(runs) == 1:
+                found = candidate_cache.get(row[1:-1:2], numbers, row[-1], allowed[0])
+            else:
+                found = candidate_cache.get(row[1:-1:2], numbers, row[-1], allowed, runs)
+            saved = (row, numbers, found)
+            self.row_cache[i] = saved
+            # Only count the work when the shared cache had to work the candidates out.
+            if record and candidate_cache.misses > misses:
+                record["evaluations"] += math.prod(math.perm(len(allowed[k]), numbers[start:stop].count(None))
+                                                   for k, (start, stop) in enumerate(runs))
+        return saved[1], saved[2]
+
+
+    def make_solver(self, record=None):
+        """Makes a solver for the current grid.
+
+        Args:
+            record {(string): ...}: Metrics record to fill in, None to not record.
+
+        Returns:
+            ((Solver), ((int))[][]): Solver (None if a row has no candidates) and the row candidates.
+
+        """
+        # Find valid row permutations.
+        row_solutions = []
+        row_numbers = []
+        for i in range(0, self.size, 2):
+            numbers, found = self.row_candidates(i, record)
+            row_solutions.append(found)
+            row_numbers.append(numbers)
+        # Checks how big the state space would be with this grid.
+        state_space = 1
+        for i in row_solutions:
+            state_space *= len(i)
+        if record:
+            record["row_candidates"] = [len(i) for i in row_solutions]
+            record["state_space"] = state_space
+        if state_space == 0:
+            return None, row_solutions
+        operators = [[self.current_grid[x][i*2] for x in range(1, self.size-1, 2)]
+                     for i in range(self.size//2)]
+        return Solver(row_solutions, row_numbers, operators, self.current_grid[-1][:-1:2]), row_solutions
 
 
-    def check_columns(self, solution):
-        """Checks all the columns of the grid with given solution.
+    def within_budget(self, budget, record=None):
+        """Checks if all solutions of the current grid can be found within a budget.
 
-        Loops all columns return false if new evaluated equations don't equal totals.
+        Runs the same search as get_solutions without storing the solutions.
+        For unique grids the search stops as soon as a second solution is found,
+        and the grid is only within budget if it has exactly one solution.
 
         Args:
-            solution [{((int),(int)): (int)}]: Solution to try.
+            budget (int): Most work to do before giving up.
+            record {(string): ...}: Metrics record to count search nodes in, None to not record.
 
         Returns:
-            (bool): True if all columns are valid.
+            (bool): True if the search finishes within the budget.
 
         """
-        # For all the values in the solution dictionary put them into the temp grid
-        for (i, j), value in solution.items():
-            self.grid[i][j] = value
-        # Check the columns to make sure they are valid
-        for i in range(self.size//2):
-            equation = "".join([self.grid[x][i*2] for x in range(self.size-1)])
-            if self.grid[-1][i*2] != evaluate(equation, 0, self.size-2):
-                return False
-        return True
+        solver, row_solutions = self.make_solver()
+        if solver is None:
+            return False
+        if self.pool and (self.unique or not self.lazy):
+            found = len(self.pool.solutions(solver, 2 if self.unique else None, budget))
+        elif self.unique:
+            found = solver.count_up_to(2, budget)
+        elif self.lazy:
+            found = solver.count(budget)
+        else:
+            found = sum(1 for picks in solver.iter_solutions(budget))
+        if record:
+            record["nodes"] += solver.nodes
+        if self.unique:
+            return found == 1 and solver.complete
+        return solver.complete
 
 
-    def gen_grid(self, size, diffculty):
+    def gen_grid(self, size, diffculty, remove=True):
         """Generates a game grid.
 
-        Generates a random grid with the limits of 1-9 and each row cannot have duplicates.
+        Generates a random grid with the limits of 1-9 and each row (run of a row
+        for grids over 18) cannot have duplicates.
         Also it randomly picks operators to put in, Then calculates the row/column totals.
         It then randomly removes (puts "?") numbers and stores which locations where removed.
 
         Args:
             size (int): Size of the grid to generate.
             diffculty (int): Used to determine the amount of numbers to remove from each row.
+            remove (bool): Remove numbers, otherwise the full grid is returned.
 
         Returns:
             grid (string)[][]: Generated grid represented.
@@ -317,8 +2212,9 @@ class Grid:
         self.unknown = 0
         # options for signs
         operators = list(order.keys())
-        # number range randomly 1-9 all numbers for a new grid
-        numbers = [random.sample(range(1,10),size//2) for x in range(size//2)]
+        # number range randomly 1-9 all numbers for a new grid (no repeats in each run of a row)
+        numbers = [sum([random.sample(range(1,digits+1),stop-start) for start, stop in segments(size//2)], [])
+                   for x in range(size//2)]
         # generate an empty grid
         grid = [[None]*size for i in range(size)]
         # fill in grid with random numbers and operators
@@ -328,18 +2224,23 @@ class Grid:
                     grid[i][j] = random.choice(operators)
                 elif (i%2==0 and j%2==0):
                     grid[i][j] = str(numbers[i//2][j//2])
+        # compile the row and column equations once for checking solutions
+        self.row_plans = [compile_equation(grid[i*2][1:-1:2]) for i in range(size//2)]
+        self.column_plans = [compile_equation([grid[x][i*2] for x in range(1, size-1, 2)])
+                             for i in range(size//2)]
         # add totals
         for i in range(size//2):
-            grid[i*2][-1] = evaluate("".join(grid[i*2][:-1]), 0, size-2)
-            grid[-1][i*2] = evaluate("".join([grid[x][i*2] for x in range(size-1)]), 0, size-2)
+            grid[i*2][-1] = self.row_plans[i](numbers[i])
+            grid[-1][i*2] = self.column_plans[i]([numbers[x][i] for x in range(size//2)])
+        self.numbers = numbers
         # randomly remove numbers and replace with "?" and count them
-        self.missing = dict()
+        self.missing = {i: [] for i in range(0, size, 2)}
+        if not remove:
+            return grid
+        counts = missing_counts(size, diffculty)
         for i in range(0,size,2):
-            for j in random.sample(range(0,size,2), diffculty_map[self.diffculty][self.size]):
-                if i in self.missing:
-                    self.missing[i].append(j)
-                else:
-                    self.missing[i] = [j]
+            for j in random.sample(range(0,size,2), counts[i//2]):
+                self.missing[i].append(j)
                 grid[i][j] = "?"
                 self.unknown += 1
 
@@ -347,6 +2248,94 @@ class Grid:
         return grid
 
 
+    def build_grid(self, size, diffculty, record=None):
+        """Builds a game grid one missing number at a time.
+
+        Generates a full grid like gen_grid, then removes numbers in rounds of one
+        from each row (rows in random order, skipping rows that have had all theirs
+        removed). After each removal it checks that the solutions can still be found
+        within a 16th of the budget, or a 4th for grids that are only counted since
+        counting is their whole search (and that there is still only one for unique
+        grids), otherwise it puts the number back and tries
+        another in the row. If no number in the row can be removed only that row's
+        operators are picked again, which changes the row total but no column,
+        and the rest of the grid is kept.
+
+        Args:
+            size (int): Size of the grid to build.
+            diffculty (int): Used to determine the amount of numbers to remove from each row.
+            record {(string): ...}: Metrics record to count the checking work in, None to not record.
+
+        Returns:
+            grid (string)[][]: Built grid, None if a row could not be built.
+
+        """
+        self.current_grid = self.gen_grid(size, diffculty, remove=False)
+        rows = list(range(0, size, 2))
+        counts = missing_counts(size, diffculty)
+        for k in range(max(counts)):
+            random.shuffle(rows)
+            for i in rows:
+                if counts[i//2] <= k:
+                    continue
+                for tries in range(3):
+                    if self.remove_number(i, record):
+                        break
+                    self.reroll_row(i)
+                else:
+                    return None
+        return self.current_grid
+
+
+    def remove_number(self, i, record=None):
+        """Removes one more number from a row if the grid stays within budget.
+
+        Tries the numbers that leave the row with the fewest candidates first,
+        and skips the search when the product of row candidate counts is
+        small enough that it could not run over budget (or is one for unique grids).
+
+        Args:
+            i (int): Row to remove a number from.
+            record {(string): ...}: Metrics record to count evaluations and search nodes in, None to not record.
+
+        Returns:
+            (bool): True if a number was removed.
+
+        """
+        budget = solve_budget//(4 if self.lazy else 16)
+        options = []
+        for j in range(0, self.size, 2):
+            if self.current_grid[i][j] != "?":
+                self.current_grid[i][j] = "?"
+                options.append((len(self.row_candidates(i, record)[1]), random.random(), j))
+                self.current_grid[i][j] = str(self.numbers[i//2][j//2])
+        for count, order_key, j in sorted(options):
+            self.current_grid[i][j] = "?"
+            state_space = self.size//2
+            for k in range(0, self.size, 2):
+                state_space *= len(self.row_candidates(k, record)[1])
+            small = state_space == self.size//2 if self.unique else state_space <= budget
+            if small or self.within_budget(budget, record):
+                self.missing[i].append(j)
+                self.unknown += 1
+                return True
+            self.current_grid[i][j] = str(self.numbers[i//2][j//2])
+        return False
+
+
+    def reroll_row(self, i):
+        """Picks new operators for a row and works out its new total.
+
+        Args:
+            i (int): Row to pick new operators for.
+
+        """
+        for j in range(1, self.size-1, 2):
+            self.current_grid[i][j] = random.choice(codes)
+        self.row_plans[i//2] = compile_equation(self.current_grid[i][1:-1:2])
+        self.current_grid[i][-1] = self.row_plans[i//2](self.numbers[i//2])
+
+
     def try_move(self, row, col, val):
         """Test if the given move is valid and part of a solution.
 
@@ -363,45 +2352,255 @@ class Grid:
             (bool): If the move was good or bad.
 
         """
-        new_solutions = []
-        # Get all solutions where the move is part of them.
-        for solution in self.solutions:
-            if (row,col) in solution:
-                if int(solution[(row,col)]) == val:
-                    new_solutions.append(solution)
-        # Check if there is solutions with the move.
-        if len(new_solutions) > 0:
-            # Update solutions
-            self.solutions = new_solutions
-            self.solution_count = len(new_solutions)
+        # Keep only the solutions where the move is part of them.
+        before = self.solutions.state()
+        if self.solutions.keep(row, col, val):
+            self.solution_count = len(self.solutions)
             # If move is duplicate move ignore it
             if self.current_grid[row][col] == "?":
                 self.current_grid[row][col] = val
                 self.unknown -= 1
+                self.history.append((row, col, before))
+                self.undone = []
                 return True
         # Add one to bad moves for final score.
         self.badmoves += 1
         return False
 
 
+    def undo(self):
+        """Takes back the last move (or hint).
+
+        Returns:
+            ((int), (int), (int)): Row, column and value taken back, None if there are no moves.
+
+        """
+        if not self.history:
+            return None
+        row, col, before = self.history.pop()
+        val = self.current_grid[row][col]
+        self.solutions.restore(before)
+        self.solution_count = len(self.solutions)
+        self.current_grid[row][col] = "?"
+        self.unknown += 1
+        self.undone.append((row, col, val))
+        return (row, col, val)
+
+
+    def redo(self):
+        """Puts back the last move taken back.
+
+        Returns:
+            ((int), (int), (int)): Row, column and value put back, None if there is nothing to redo.
+
+        """
+        if not self.undone:
+            return None
+        undone = self.undone
+        row, col, val = undone.pop()
+        self.try_move(row, col, val)
+        self.undone = undone
+        return (row, col, val)
+
+
+    def branch(self):
+        """Makes a copy of the game to try moves in without changing this one.
+
+        The copy shares the stored solutions and the states in the history,
+        so it only needs memory for its own counts and grid.
+
+        Returns:
+            (Grid): Grid in the same state.
+
+        """
+        grid = copy.copy(self)
+        grid.current_grid = [list(row) for row in self.current_grid]
+        grid.solutions = self.solutions.branch()
+        grid.history = list(self.history)
+        grid.undone = list(self.undone)
+        return grid
+
+
     def get_hint(self):
         """Puts in a random move that leads to a solution.
 
-        Randomly picks a solution then trys the moves in random order,
-        until one is added. Then tells the user a move was added and increments the hints.
+        Puts in a cell that only has one value left if there is one.
+        Otherwise randomly picks a solution then trys the moves in random order,
+        until one is added. Then increments the hints and returns the move added.
+
+        Returns:
+            ((int), (int), (int)): Row, column and value added, None if nothing was added.
 
         """
+        if self.solutions.forced:
+            (i, j), val = random.choice(list(self.solutions.forced.items()))
+            if self.try_move(i, j, val):
+                self.hints += 1
+                return (i, j, val)
         # Gets random solution
-        moves = list(self.solutions[random.randint(0,len(self.solutions)-1)].items())
+        moves = list(self.solutions.choice().items())
         # suffles moves so it doesnt fill top to bottom (simulates randomness)
         random.shuffle(moves)
         for (i,j), val in moves:
             # NOTE: Double checking to save time but probably not needed
             if self.current_grid[i][j] == "?":
-                if self.try_move(i, j, int(val)):
-                    print("Value", val, "added at", i, j)
+                if self.try_move(i, j, val):
                     self.hints += 1
-                    break
+                    return (i, j, val)
+        return None
+
+
+    def candidate_counts(self):
+        """Gets how many values each unknown cell can still take.
+
+        Returns:
+            {((int),(int)): (int)}: Amount of values left for each unknown cell.
+
+        """
+        return {(i, j): len(self.solutions.domain(i, j)) for i, j in self.solutions.cells
+                if self.current_grid[i][j] == "?"}
+
+
+    def to_dict(self, solutions=False):
+        """Gets a plain representation of the grid that can be saved as JSON.
+
+        Args:
+            solutions (bool): Also include the values of every solution.
+
+        Returns:
+            {(string): ...}: Parameters and modes, seed, grid and solution count (and solutions).
+
+        """
+        output = {"size": self.size, "diffculty": self.diffculty, "base": self.base,
+                  "seed": self.seed, "lazy": self.lazy, "constructive": self.constructive,
+                  "unique": self.unique, "band": list(self.band) if self.band else None,
+                  "grid": self.current_grid, "solution_count": self.solution_count}
+        if solutions:
+            output["cells"] = self.solutions.cells
+            output["solutions"] = [[solution[cell] for cell in self.solutions.cells]
+                                   for solution in self.solutions]
+        return output
+
+
+    def encode(self, solutions=False, seed=False):
+        """Encodes the grid in a compact binary form.
+
+        The form is a size byte, a byte of flags (diffculty, base, solutions, seed,
+        constructive, unique), a bitmask of the unknown cells, 4 bits for each known number, 3 bits for each
+        operator (its place in order), then the row and column totals as zigzag varints.
+        Solutions are a varint count then 4 bits for each unknown cell of each solution.
+        With seed only the parameters, the seed, the level of the grade band (0 for none)
+        and if the grid is lazy (it changes which grids are accepted) are saved, and decode
+        makes the grid again.
+
+        Args:
+            solutions (bool): Also encode every solution.
+            seed (bool): Only encode the parameters and seed the grid was generated with.
+
+        Returns:
+            (bytes): Encoded grid.
+
+        Raises:
+            ValueError: If only the seed is wanted but the grid was not made from a seed
+                (or in a band that is not one of grade_bands).
+
+        """
+        if seed and self.seed is None:
+            raise ValueError("Grid was not generated from a seed")
+        levels = [None] + [grade_bands[level] for level in grade_bands]
+        if seed and self.band not in levels:
+            raise ValueError("Grid was not generated in one of the grade bands")
+        n = self.size//2
+        flags = self.diffculty | list(base_formats).index(self.base) << 2
+        flags |= (solutions and not seed) << 4 | seed << 5 | self.constructive << 6 | self.unique << 7
+        output = bytearray([self.size, flags])
+        if seed:
+            write_varint(output, self.seed)
+            write_varint(output, levels.index(self.band))
+            write_varint(output, self.lazy)
+            return bytes(output)
+        numbers = [self.current_grid[i][j] for i in range(0, self.size, 2) for j in range(0, self.size, 2)]
+        output += pack_bits([x == "?" for x in numbers], 1)
+        output += pack_bits([int(x) for x in numbers if x != "?"], 4)
+        operators = [self.current_grid[i][j] for i in range(0, self.size, 2) for j in range(1, self.size-1, 2)]
+        operators += [self.current_grid[i][j] for i in range(1, self.size-1, 2) for j in range(0, self.size, 2)]
+        output += pack_bits([codes.index(x) for x in operators], 3)
+        for i in range(n):
+            write_varint(output, self.current_grid[i*2][-1])
+        for i in range(n):
+            write_varint(output, self.current_grid[-1][i*2])
+        if solutions:
+            cells = [(i, j) for i in range(0, self.size, 2) for j in range(0, self.size, 2)
+                     if self.current_grid[i][j] == "?"]
+            found = list(self.solutions)
+            write_varint(output, len(found))
+            output += pack_bits([solution[cell] for solution in found for cell in cells], 4)
+        return bytes(output)
+
+
+    @classmethod
+    def decode(cls, data, base=None, lazy=False):
+        """Makes a grid from the form made by encode.
+
+        Args:
+            data (bytes): Encoded grid.
+            base (int): Number base representation for output, None for the encoded base.
+            lazy (bool): Only count the solutions if they have to be found (a grid encoded
+                by seed is made again with the lazy it was generated with).
+
+        Returns:
+            (Grid): Grid ready to play.
+
+        Examples:
+            A lazy grid made again from its seed.
+
+            >>> grid = Grid(12, 3, 10, seed=3, lazy=True)
+            >>> again = Grid.decode(grid.encode(seed=True))
+            >>> print(again.lazy, again.current_grid == grid.current_grid)
+            True True
+
+        """
+        size, flags = data[0], data[1]
+        diffculty = flags & 3
+        base = base or list(base_formats)[flags >> 2 & 3]
+        if flags >> 5 & 1:
+            seed, offset = read_varint(data, 2)
+            level, offset = read_varint(data, offset) if offset < len(data) else (0, offset)
+            lazy = bool(read_varint(data, offset)[0]) if offset < len(data) else lazy
+            return cls(size, diffculty, base, lazy, seed, constructive=bool(flags >> 6 & 1),
+                       unique=bool(flags >> 7 & 1), band=grade_bands.get(level))
+        n = size//2
+        offset = 2
+        unknown = unpack_bits(data[offset:], 1, n*n)
+        offset += (n*n+7)//8
+        known = n*n-sum(unknown)
+        digits = iter(unpack_bits(data[offset:], 4, known))
+        offset += (known*4+7)//8
+        operators = iter([codes[x] for x in unpack_bits(data[offset:], 3, 2*n*(n-1))])
+        offset += (2*n*(n-1)*3+7)//8
+        grid = [[None]*size for i in range(size)]
+        for i in range(0, size, 2):
+            for j in range(0, size, 2):
+                grid[i][j] = "?" if unknown[i//2*n+j//2] else str(next(digits))
+        for i in range(0, size, 2):
+            for j in range(1, size-1, 2):
+                grid[i][j] = next(operators)
+        for i in range(1, size-1, 2):
+            for j in range(0, size, 2):
+                grid[i][j] = next(operators)
+        for i in range(n):
+            grid[i*2][-1], offset = read_varint(data, offset)
+        for i in range(n):
+            grid[-1][i*2], offset = read_varint(data, offset)
+        puzzle = {"size": size, "diffculty": diffculty, "base": base, "grid": grid,
+                  "constructive": bool(flags >> 6 & 1), "unique": bool(flags >> 7 & 1)}
+        if flags >> 4 & 1:
+            count, offset = read_varint(data, offset)
+            cells = [(i, j) for i in range(0, size, 2) for j in range(0, size, 2) if grid[i][j] == "?"]
+            values = unpack_bits(data[offset:], 4, count*len(cells))
+            puzzle["cells"] = cells
+            puzzle["solutions"] = [values[k*len(cells):(k+1)*len(cells)] for k in range(count)]
+        return cls.from_dict(puzzle, base, lazy)
 
 
     def __str__(self):
@@ -456,13 +2655,13 @@ if __name__ == "__main__":
         if action == "r":
             while True:
                 try:
-                    print("Size 4|6|8|10|12|14|16|18? ", end="")
+                    print("Size 4|6|...|18 (20-32 marathon)? ", end="")
                     size = int(input())
                     print("Diffculty 1:(Easy)|2:(Medium)|3:(Hard)? ", end="")
                     diffculty = int(input())
                     print("Base? 2|8|10|16? ", end="")
                     base = int(input())
-                    if size in range(4,20,2) and diffculty in [1,2,3] and base in [2,8,10,16]:
+                    if size in diffculty_map[1] and diffculty in [1,2,3] and base in [2,8,10,16]:
                         grid = Grid(size, diffculty, base)
                         print(grid)
                         break
@@ -481,8 +2680,18 @@ if __name__ == "__main__":
             except:
                 print("Bad move.")
         elif action == "h":
-            grid.get_hint()
+            hint = grid.get_hint()
+            if hint:
+                print("Value", hint[2], "added at", hint[0], hint[1])
+            print(grid)
+        elif action == "u" or action == "d":
+            move = grid.undo() if action == "u" else grid.redo()
+            if move:
+                print("Value", move[2], "taken back at" if action == "u" else "put back at", move[0], move[1])
             print(grid)
+        elif action == "c":
+            for (i, j), count in grid.candidate_counts().items():
+                print("Cell", i, j, "can be", count, "values")
         else:
             print("Invalid action... Retry.")
         if grid.unknown == 0:
@@ -490,7 +2699,7 @@ if __name__ == "__main__":
             print(grid)
             print("You finished")
             break
-        print("Action m:(move)|h:(hint)|r:(restart)|q:(quit)? ")
+        print("Action m:(move)|h:(hint)|u:(undo)|d:(redo)|c:(candidates)|r:(restart)|q:(quit)? ")
         action = input()
 # /////////////////////////////////////////////////////////////////////////////////////////////////
 # Main Start
@@ -0,0 +1,353 @@
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+import array
+import concurrent.futures
+import mmap
+import multiprocessing
+import os
+import random
+import threading
+from s5084150_game import Grid
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# make_record Function Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def make_record(task):
+    """Generates one encoded puzzle with its solutions in a worker process.
+
+    Args:
+        task ((int), (int), (int)): Size, diffculty and seed.
+
+    Returns:
+        (bytes): Puzzle from Grid.encode, with solutions unless they are only counted.
+
+    """
+    size, diffculty, seed = task
+    grid = Grid(size, diffculty, 10, seed=seed)
+    return grid.encode(solutions=not grid.lazy)
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# make_record Function End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# PuzzleFile Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class PuzzleFile:
+    """A class to store pre-solved puzzles of one size and diffculty on disk.
+
+    Encoded puzzles are appended to a data file as length prefixed records and read
+    back through a memory map. An index file holds the offset of every
+    puzzle still in the pool, so a random puzzle is found in O(1). Taking a
+    puzzle moves the last offset into its place and shortens the index.
+    The bytes of taken puzzles still in the data file are worked out again
+    from the index when the file is opened. Compacting writes new files next
+    to the old ones and replaces them, so stopping part way never loses the pool.
+
+    Args:
+        path (string): Path of the data file, the index file adds ".idx".
+
+    Attributes:
+        offsets (array): Offset of every puzzle in the data file.
+        dead (int): Bytes of taken puzzles still in the data file.
+
+    """
+
+
+    def __init__(self, path):
+        self.path = path
+        self.open()
+
+
+    def open(self):
+        """Opens the data and index files, finishing a compact that was stopped."""
+        path = self.path
+        if os.path.exists(path+".tmp"):
+            # Stopped before the data file was replaced, the old files are still whole.
+            os.remove(path+".tmp")
+            if os.path.exists(path+".idx.tmp"):
+                os.remove(path+".idx.tmp")
+        elif os.path.exists(path+".idx.tmp"):
+            # Stopped between the two replaces, the new index goes with the new data file.
+            os.replace(path+".idx.tmp", path+".idx")
+        self.data = open(path, "a+b")
+        # Not "a+b", taking a puzzle writes into the middle of the index.
+        if not os.path.exists(path+".idx"):
+            open(path+".idx", "wb").close()
+        self.index = open(path+".idx", "r+b")
+        self.offsets = array.array("Q")
+        self.offsets.frombytes(self.index.read())
+        self.map = None
+        live = sum(len(self.read(i))+4 for i in range(len(self.offsets)))
+        self.dead = os.path.getsize(path)-live
+
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+    def add(self, record):
+        """Adds a puzzle to the end of the file.
+
+        Args:
+            record (bytes): Encoded puzzle.
+
+        """
+        self.data.seek(0, os.SEEK_END)
+        offset = self.data.tell()
+        self.data.write(len(record).to_bytes(4, "little")+record)
+        self.data.flush()
+        self.offsets.append(offset)
+        self.index.seek(0, os.SEEK_END)
+        self.index.write(self.offsets[-1:].tobytes())
+        self.index.flush()
+
+
+    def read(self, i):
+        """Reads the puzzle at a place in the index.
+
+        Args:
+            i (int): Place in the index.
+
+        Returns:
+            (bytes): Encoded puzzle.
+
+        """
+        offset = self.offsets[i]
+        # Map the file again if the puzzle was added after the last map.
+        if self.map is None or offset+4 > len(self.map):
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.data.fileno(), 0, access=mmap.ACCESS_READ)
+        length = int.from_bytes(self.map[offset:offset+4], "little")
+        return self.map[offset+4:offset+4+length]
+
+
+    def take(self, i=None):
+        """Removes a puzzle from the pool and returns it.
+
+        Args:
+            i (int): Place in the index, None for a random puzzle.
+
+        Returns:
+            (bytes): Encoded puzzle, None if the pool is empty.
+
+        """
+        if not self.offsets:
+            return None
+        if i is None:
+            i = random.randrange(len(self.offsets))
+        record = self.read(i)
+        self.dead += len(record)+4
+        self.offsets[i] = self.offsets[-1]
+        self.offsets.pop()
+        self.index.truncate(len(self.offsets)*self.offsets.itemsize)
+        if i < len(self.offsets):
+            self.index.seek(i*self.offsets.itemsize)
+            self.index.write(self.offsets[i:i+1].tobytes())
+        self.index.seek(0, os.SEEK_END)
+        self.index.flush()
+        return record
+
+
+    def compact(self):
+        """Rewrites the data file with only the puzzles still in the pool.
+
+        The new data and index files are written to ".tmp" files first, then
+        replace the old ones (data file first) and are opened again.
+
+        """
+        offsets = array.array("Q")
+        with open(self.path+".tmp", "wb") as data:
+            for i in range(len(self.offsets)):
+                record = self.read(i)
+                offsets.append(data.tell())
+                data.write(len(record).to_bytes(4, "little")+record)
+            data.flush()
+            os.fsync(data.fileno())
+        with open(self.path+".idx.tmp", "wb") as index:
+            index.write(offsets.tobytes())
+            index.flush()
+            os.fsync(index.fileno())
+        self.close()
+        os.replace(self.path+".tmp", self.path)
+        os.replace(self.path+".idx.tmp", self.path+".idx")
+        self.open()
+
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.data.close()
+        self.index.close()
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# PuzzleFile Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# PuzzlePool Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class PuzzlePool:
+    """A class to keep pools of pre-solved puzzles ready for new games.
+
+    Keeps one PuzzleFile for each (size, diffculty) in a directory. A background
+    worker watches the pools and when one drops below the low watermark it
+    generates puzzles in other processes until the pool is back at the high watermark.
+
+    Args:
+        directory (string): Directory to keep the pool files in.
+        keys ((int, int))[]: (size, diffculty) pairs to keep pools for.
+        low (int): Pool size that starts a refill.
+        high (int): Pool size a refill stops at.
+        workers (int): Processes used to generate puzzles.
+
+    Examples:
+        Getting a new grid from the pool.
+
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as directory:
+        ...     pool = PuzzlePool(directory, [(8, 2)], low=5, high=20)
+        ...     pool.start()
+        ...     grid = pool.grid(8, 2, 10)
+        ...     pool.stop()
+
+    """
+
+
+    def __init__(self, directory, keys, low=10, high=50, workers=1):
+        os.makedirs(directory, exist_ok=True)
+        self.low = low
+        self.high = high
+        self.workers = workers
+        self.files = dict()
+        for size, diffculty in keys:
+            path = os.path.join(directory, "{0}_{1}.pool".format(size, diffculty))
+            self.files[(size, diffculty)] = PuzzleFile(path)
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+
+
+    def count(self, size, diffculty):
+        """Gets the amount of puzzles in a pool.
+
+        Args:
+            size (int): Grid size.
+            diffculty (int): Level of diffculty.
+
+        Returns:
+            (int): Puzzles in the pool.
+
+        """
+        with self.lock:
+            return len(self.files[(size, diffculty)])
+
+
+    def add(self, record):
+        """Adds a puzzle to its pool.
+
+        Args:
+            record (bytes): Puzzle from Grid.encode with solutions.
+
+        """
+        with self.lock:
+            self.files[(record[0], record[1] & 3)].add(record)
+
+
+    def take(self, size, diffculty):
+        """Takes a random puzzle out of a pool.
+
+        Args:
+            size (int): Grid size.
+            diffculty (int): Level of diffculty.
+
+        Returns:
+            (bytes): Puzzle from Grid.encode, None if the pool is empty.
+
+        """
+        with self.lock:
+            pool = self.files[(size, diffculty)]
+            record = pool.take()
+            if len(pool) < self.low:
+                self.wake.set()
+        return record
+
+
+    def grid(self, size, diffculty, base):
+        """Gets a grid ready to play, from the pool when it has one.
+
+        Args:
+            size (int): Grid size.
+            diffculty (int): Level of diffculty.
+            base (int): Number base representation for output.
+
+        Returns:
+            (Grid): New grid.
+
+        """
+        record = self.take(size, diffculty) if (size, diffculty) in self.files else None
+        if record is None:
+            return Grid(size, diffculty, base)
+        return Grid.decode(record, base)
+
+
+    def refill(self, executor=None):
+        """Fills every pool below the low watermark up to the high watermark.
+
+        Args:
+            executor (Executor): Executor to generate puzzles in, None to generate here.
+
+        """
+        for (size, diffculty), pool in self.files.items():
+            with self.lock:
+                need = self.high-len(pool) if len(pool) < self.low else 0
+            tasks = [(size, diffculty, random.getrandbits(64)) for i in range(need)]
+            records = executor.map(make_record, tasks) if executor else map(make_record, tasks)
+            for record in records:
+                self.add(record)
+                if not self.running and executor:
+                    break
+            with self.lock:
+                # Drop taken puzzles once they are most of the file.
+                if pool.dead*2 > os.path.getsize(pool.path):
+                    pool.compact()
+
+
+    def run(self):
+        """Refills the pools in the background until stopped."""
+        # Processes are spawned, this runs in a thread and a forked process can inherit locks held by others.
+        executor = concurrent.futures.ProcessPoolExecutor(self.workers, multiprocessing.get_context("spawn"))
+        try:
+            while self.running:
+                self.refill(executor)
+                self.wake.wait(1.0)
+                self.wake.clear()
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+
+    def start(self):
+        """Starts the background refill worker."""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        """Stops the background refill worker and closes the pool files."""
+        self.running = False
+        self.wake.set()
+        if self.thread:
+            self.thread.join()
+        for pool in self.files.values():
+            pool.close()
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# PuzzlePool Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
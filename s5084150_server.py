@@ -0,0 +1,394 @@
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import random
+import sys
+import time
+import uuid
+from s5084150_game import Grid, diffculty_map, base_formats, marathon_size
+from s5084150_pool import PuzzlePool, make_record
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# load_grid Function Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+def load_grid(task):
+    """Makes a grid ready to play in a worker process.
+
+    Generated grids are encoded and decoded too, so the grid sent back
+    has no compiled equations (which can not be pickled).
+
+    Args:
+        task ((bytes), (int), (int), (int), (int)): Puzzle from Grid.encode (None to generate
+            one), size, diffculty, base and seed.
+
+    Returns:
+        (Grid): Grid with its solutions.
+
+    """
+    record, size, diffculty, base, seed = task
+    if record is None:
+        record = make_record((size, diffculty, seed))
+    return Grid.decode(record, base)
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# load_grid Function End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Session Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class Session:
+    """A class to hold one player's grid.
+
+    Args:
+        grid (Grid): Grid being played.
+
+    Attributes:
+        id (string): Session id given to the player.
+        grid (Grid): Grid being played.
+        last_used (float): Time the session was last used.
+        lock (Lock): Held while the grid is played, so requests to one session run in order.
+
+    """
+
+
+    def __init__(self, grid):
+        self.id = uuid.uuid4().hex
+        self.grid = grid
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+
+
+    def to_dict(self):
+        """Gets the state of the session to send to the player.
+
+        Returns:
+            {(string): ...}: Session id, grid, unknown and solution count.
+
+        """
+        return {"session": self.id, "grid": self.grid.current_grid, "base": self.grid.base,
+                "unknown": self.grid.unknown, "solutions": self.grid.solution_count,
+                "finished": self.grid.unknown == 0}
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Session Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# SessionManager Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class SessionManager:
+    """A class to run many games at once on one event loop.
+
+    Moves and hints are answered straight away on the event loop since they
+    only need a few bitset operations, but on lazy grids (every marathon grid)
+    they count the solutions again so they are run in a thread. New grids are
+    generated (or decoded from the pool and their solutions found) in other
+    processes so a large grid never stalls the other sessions, and sessions that
+    are not used for a while are evicted.
+
+    Args:
+        executor (Executor): Process executor to generate grids in.
+        timeout (float): Seconds a session can be idle before it is evicted.
+        pool (PuzzlePool): Pool to take pre-solved grids from, None to always generate.
+
+    Attributes:
+        sessions {(string): (Session)}: Sessions by id.
+
+    """
+
+
+    def __init__(self, executor, timeout=600.0, pool=None):
+        self.executor = executor
+        self.timeout = timeout
+        self.pool = pool
+        self.sessions = dict()
+
+
+    async def new_game(self, size, diffculty, base):
+        """Starts a new session with a new grid.
+
+        Args:
+            size (int): Grid size.
+            diffculty (int): Level of diffculty.
+            base (int): Number base representation for output.
+
+        Returns:
+            (Session): The new session.
+
+        """
+        if size not in diffculty_map[1] or diffculty not in diffculty_map or base not in base_formats:
+            raise ValueError("Incorrect parameters")
+        loop = asyncio.get_running_loop()
+        record = None
+        if self.pool and (size, diffculty) in self.pool.files:
+            record = self.pool.take(size, diffculty)
+        task = (record, size, diffculty, base, random.getrandbits(64))
+        grid = await loop.run_in_executor(self.executor, load_grid, task)
+        session = Session(grid)
+        self.sessions[session.id] = session
+        return session
+
+
+    def get(self, id):
+        """Gets a session and marks it as used.
+
+        Args:
+            id (string): Session id.
+
+        Returns:
+            (Session): The session.
+
+        Raises:
+            KeyError: If there is no session with the id.
+
+        """
+        session = self.sessions.get(id)
+        if session is None:
+            raise KeyError("Unknown session")
+        session.last_used = time.monotonic()
+        return session
+
+
+    async def play(self, session, response, work=None, *args):
+        """Runs a call on a session's grid and adds the session state to the response.
+
+        Lazy grids are played in a thread so the event loop keeps answering the
+        other sessions, and the session lock keeps a second request from changing
+        the grid before the first one is answered.
+
+        Args:
+            session (Session): Session being played.
+            response {(string): ...}: Response to add the session state to.
+            work (function): Grid method to call, None to only add the state.
+            args (...)[]: Arguments for the call.
+
+        Returns:
+            (...): What the call returned.
+
+        """
+        async with session.lock:
+            result = None
+            if work is not None and session.grid.lazy:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(None, work, *args)
+            elif work is not None:
+                result = work(*args)
+            response.update(session.to_dict())
+        return result
+
+
+    def evict(self):
+        """Removes sessions that have been idle for longer than the timeout.
+
+        Returns:
+            (int): Amount of sessions removed.
+
+        """
+        now = time.monotonic()
+        idle = [id for id, session in self.sessions.items() if now-session.last_used > self.timeout]
+        for id in idle:
+            del self.sessions[id]
+        return len(idle)
+
+
+    async def evict_forever(self, interval=30.0):
+        """Evicts idle sessions every interval seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            self.evict()
+
+
+    async def handle(self, request):
+        """Answers one request from a player.
+
+        Requests are {"op": "new", "size", "diffculty", "base"}, {"op": "move",
+        "session", "row", "col", "value"}, {"op": "hint", "session"}, {"op": "undo", "session"},
+        {"op": "redo", "session"}, {"op": "branch", "session"} (a new session with a copy
+        of the game), {"op": "candidates", "session"}, {"op": "show", "session"} and
+        {"op": "close", "session"}. An "id" in the request is sent back.
+
+        Args:
+            request {(string): ...}: Request from the player.
+
+        Returns:
+            {(string): ...}: Response with "ok" and the session state or an "error".
+
+        """
+        if not isinstance(request, dict):
+            return {"id": None, "ok": False, "error": "Request is not an object"}
+        response = {"id": request.get("id")}
+        try:
+            op = request["op"]
+            if op == "new":
+                session = await self.new_game(int(request["size"]), int(request["diffculty"]),
+                                              int(request.get("base", 10)))
+                response.update(session.to_dict())
+                response["ok"] = True
+            elif op == "move":
+                session = self.get(request["session"])
+                value = request["value"]
+                if isinstance(value, str):
+                    value = int(value, session.grid.base)
+                response["ok"] = await self.play(session, response, session.grid.try_move,
+                                                 int(request["row"]), int(request["col"]), value)
+            elif op == "hint":
+                session = self.get(request["session"])
+                response["hint"] = await self.play(session, response, session.grid.get_hint)
+                response["ok"] = response["hint"] is not None
+            elif op == "undo" or op == "redo":
+                session = self.get(request["session"])
+                work = session.grid.undo if op == "undo" else session.grid.redo
+                response["move"] = await self.play(session, response, work)
+                response["ok"] = response["move"] is not None
+            elif op == "branch":
+                source = self.get(request["session"])
+                async with source.lock:
+                    session = Session(source.grid.branch())
+                self.sessions[session.id] = session
+                response.update(session.to_dict())
+                response["ok"] = True
+            elif op == "candidates":
+                session = self.get(request["session"])
+                counts = await self.play(session, response, session.grid.candidate_counts)
+                response["candidates"] = [[i, j, count] for (i, j), count in counts.items()]
+                response["ok"] = True
+            elif op == "show":
+                session = self.get(request["session"])
+                await self.play(session, response)
+                response["ok"] = True
+            elif op == "close":
+                self.sessions.pop(request["session"], None)
+                response["ok"] = True
+            else:
+                raise ValueError("Unknown op")
+        except Exception as error:
+            # Any bad request gets an error back instead of no response.
+            response["ok"] = False
+            response["error"] = str(error)
+        return response
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# SessionManager Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Serving Functions Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+async def serve_lines(manager, readline, write):
+    """Answers JSON line requests until the input ends.
+
+    Each request is answered in its own task, so a slow new game does
+    not hold up moves sent after it. Responses are written as they finish.
+
+    Args:
+        manager (SessionManager): Sessions to use.
+        readline (coroutine): Reads the next line as bytes, b"" at the end.
+        write (function): Writes a line of bytes.
+
+    """
+    async def answer(line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            response = {"ok": False, "error": "Bad JSON"}
+        else:
+            response = await manager.handle(request)
+        write((json.dumps(response)+"\n").encode())
+    tasks = set()
+    while True:
+        line = await readline()
+        if not line:
+            break
+        if line.strip():
+            task = asyncio.ensure_future(answer(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+async def serve_tcp(manager, host, port):
+    """Serves JSON lines to every connection on a socket."""
+    async def connection(reader, writer):
+        await serve_lines(manager, reader.readline, writer.write)
+        writer.close()
+    server = await asyncio.start_server(connection, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def serve_stdio(manager):
+    """Serves JSON lines from stdin to stdout.
+
+    Stdin is read by the event loop itself, so no thread is left blocked in
+    readline (holding the stdin lock) while the executor starts processes.
+    A regular file can not be watched by the loop but never blocks, so it is read directly.
+
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        readline = reader.readline
+    except ValueError:
+        async def readline():
+            return sys.stdin.buffer.readline()
+    def write(data):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+    await serve_lines(manager, readline, write)
+
+
+async def main(args):
+    # Processes are spawned, a forked process can inherit locks held by other threads.
+    context = multiprocessing.get_context("spawn")
+    pool = None
+    if args.pool:
+        keys = [(size, diffculty) for size in args.pool_sizes for diffculty in diffculty_map]
+        pool = PuzzlePool(args.pool, keys, args.pool_low, args.pool_high, args.workers)
+        pool.start()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(args.workers, context) as executor:
+            manager = SessionManager(executor, args.timeout, pool)
+            evictor = asyncio.ensure_future(manager.evict_forever(min(args.timeout, 30.0)))
+            if args.port is None:
+                await serve_stdio(manager)
+            else:
+                await serve_tcp(manager, args.host, args.port)
+            evictor.cancel()
+    finally:
+        if pool:
+            pool.stop()
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Serving Functions End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Main Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve many games as JSON lines.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="Port to listen on, stdin/stdout if not given.")
+    parser.add_argument("--workers", type=int, default=None, help="Processes used to generate grids.")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Seconds before idle sessions are evicted.")
+    parser.add_argument("--pool", default=None, help="Directory to keep pre-solved puzzles in, none if not given.")
+    parser.add_argument("--pool-sizes", type=int, nargs="+",
+                        default=[size for size in sorted(diffculty_map[1]) if size <= marathon_size])
+    parser.add_argument("--pool-low", type=int, default=10, help="Puzzles left that start a refill.")
+    parser.add_argument("--pool-high", type=int, default=50, help="Puzzles a refill stops at.")
+    asyncio.run(main(parser.parse_args()))
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Main End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
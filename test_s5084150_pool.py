@@ -0,0 +1,96 @@
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+import os
+import tempfile
+import unittest
+from s5084150_pool import PuzzleFile
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# PuzzleFileTest Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class PuzzleFileTest(unittest.TestCase):
+    """Adds, takes, reopens and compacts a pool file in a temporary directory."""
+
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "8_2.pool")
+        self.records = [bytes([i])*(i+1) for i in range(10)]
+        self.pool = PuzzleFile(self.path)
+        for record in self.records:
+            self.pool.add(record)
+
+
+    def tearDown(self):
+        self.pool.close()
+        self.directory.cleanup()
+
+
+    def contents(self):
+        """Gets the records left in the pool, in any order."""
+        return sorted(self.pool.read(i) for i in range(len(self.pool)))
+
+
+    def reopen(self):
+        """Closes the pool file and opens it again."""
+        self.pool.close()
+        self.pool = PuzzleFile(self.path)
+
+
+    def test_take(self):
+        taken = [self.pool.take(0), self.pool.take(3), self.pool.take()]
+        self.assertEqual(len(self.pool), 7)
+        self.assertEqual(sorted(taken+self.contents()), sorted(self.records))
+        self.assertEqual(self.pool.dead, sum(len(record)+4 for record in taken))
+
+
+    def test_reopen(self):
+        self.pool.take(2)
+        self.pool.take(5)
+        left, dead = self.contents(), self.pool.dead
+        self.reopen()
+        self.assertEqual(self.contents(), left)
+        self.assertEqual(self.pool.dead, dead)
+        self.pool.add(b"new")
+        self.reopen()
+        self.assertEqual(self.contents(), sorted(left+[b"new"]))
+        self.assertEqual(self.pool.dead, dead)
+
+
+    def test_compact(self):
+        for i in range(4):
+            self.pool.take(0)
+        left = self.contents()
+        self.pool.compact()
+        self.assertEqual(self.contents(), left)
+        self.assertEqual(self.pool.dead, 0)
+        self.assertEqual(os.path.getsize(self.path), sum(len(record)+4 for record in left))
+        self.reopen()
+        self.assertEqual(self.contents(), left)
+        self.assertEqual(self.pool.dead, 0)
+        self.assertFalse(os.path.exists(self.path+".tmp") or os.path.exists(self.path+".idx.tmp"))
+
+
+    def test_stopped_compact(self):
+        self.pool.take(0)
+        left, dead = self.contents(), self.pool.dead
+        self.pool.close()
+        # Stopped while writing the new files, the old ones are kept.
+        open(self.path+".tmp", "wb").close()
+        open(self.path+".idx.tmp", "wb").close()
+        self.pool = PuzzleFile(self.path)
+        self.assertEqual(self.contents(), left)
+        self.assertEqual(self.pool.dead, dead)
+        self.assertFalse(os.path.exists(self.path+".tmp") or os.path.exists(self.path+".idx.tmp"))
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# PuzzleFileTest Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+if __name__ == "__main__":
+    unittest.main()
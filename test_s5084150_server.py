@@ -0,0 +1,143 @@
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+from s5084150_game import Grid
+from s5084150_server import Session, SessionManager
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Imports End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Global Variables
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# Server script started for each test
+server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "s5084150_server.py")
+# Seconds to wait for a response before the server counts as hung
+response_timeout = 60.0
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# StdioTest Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class StdioTest(unittest.TestCase):
+    """Drives the server over stdin/stdout, keeping stdin open like a player would."""
+
+
+    def run_server(self, requests, options=()):
+        """Sends requests one at a time and gets the response to each.
+
+        Args:
+            requests ({(string): ...}|(function))[]: Requests, or functions making a request
+                from the responses so far.
+            options (string)[]: More command line options for the server.
+
+        Returns:
+            {(string): ...}[]: Response to each request.
+
+        """
+        async def run():
+            server = await asyncio.create_subprocess_exec(
+                sys.executable, server_path, "--workers", "1", *options,
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+            responses = []
+            try:
+                for request in requests:
+                    if callable(request):
+                        request = request(responses)
+                    server.stdin.write((json.dumps(request)+"\n").encode())
+                    await server.stdin.drain()
+                    line = await asyncio.wait_for(server.stdout.readline(), response_timeout)
+                    responses.append(json.loads(line))
+            finally:
+                # The end of stdin stops the server and its worker processes.
+                server.stdin.close()
+                try:
+                    await asyncio.wait_for(server.wait(), response_timeout)
+                except asyncio.TimeoutError:
+                    server.kill()
+                    raise
+            return responses
+        return asyncio.run(run())
+
+
+    def test_new_game(self):
+        new, show = self.run_server([
+            {"id": 1, "op": "new", "size": 4, "diffculty": 1},
+            lambda responses: {"id": 2, "op": "show", "session": responses[0]["session"]}])
+        self.assertTrue(new["ok"])
+        self.assertEqual(new["id"], 1)
+        self.assertEqual(len(new["grid"]), 4)
+        self.assertEqual(show["session"], new["session"])
+        self.assertEqual(show["grid"], new["grid"])
+
+
+    def test_move(self):
+        def move(responses):
+            grid = responses[0]["grid"]
+            row, col = next((i, j) for i in range(0, 4, 2) for j in range(0, 4, 2) if grid[i][j] == "?")
+            return {"op": "move", "session": responses[0]["session"], "row": row, "col": col, "value": 0}
+        new, bad_move = self.run_server([{"op": "new", "size": 4, "diffculty": 1}, move])
+        self.assertFalse(bad_move["ok"])
+        self.assertEqual(bad_move["unknown"], new["unknown"])
+
+
+    def test_bad_requests(self):
+        responses = self.run_server([[1, 2], "new", {"id": 3}, {"id": 4, "op": "fly"},
+                                     {"id": 5, "op": "show", "session": "none"},
+                                     {"id": 6, "op": "new", "size": 5, "diffculty": 1},
+                                     {"id": 7, "op": "new", "size": 4, "diffculty": 1}])
+        self.assertEqual([response["ok"] for response in responses], [False]*6+[True])
+        self.assertEqual([response["id"] for response in responses], [None, None, 3, 4, 5, 6, 7])
+        self.assertTrue(all(response["error"] for response in responses[:6]))
+
+
+    def test_pool(self):
+        with tempfile.TemporaryDirectory() as directory:
+            new, = self.run_server([{"op": "new", "size": 4, "diffculty": 2}],
+                                   ["--pool", directory, "--pool-sizes", "4", "--pool-low", "1",
+                                    "--pool-high", "2"])
+            self.assertTrue(new["ok"])
+            self.assertIn("4_2.pool", os.listdir(directory))
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# StdioTest Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# SessionManagerTest Class Start
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+class SessionManagerTest(unittest.TestCase):
+    """Plays a lazy grid through the manager, whose moves run in a thread."""
+
+
+    def test_lazy_in_order(self):
+        manager = SessionManager(None)
+        session = Session(Grid(6, 1, 10, seed=1, lazy=True))
+        manager.sessions[session.id] = session
+        unknown = session.grid.unknown
+        async def run():
+            # Sent at once, they are still answered one after the other.
+            return await asyncio.gather(*[manager.handle({"op": op, "session": session.id})
+                                          for op in ["hint", "hint", "undo", "candidates", "redo"]])
+        hint, second, undo, candidates, redo = asyncio.run(run())
+        self.assertTrue(all(response["ok"] for response in [hint, second, undo, candidates, redo]))
+        self.assertEqual([hint["unknown"], second["unknown"], undo["unknown"], redo["unknown"]],
+                         [unknown-1, unknown-2, unknown-1, unknown-2])
+        self.assertEqual(undo["move"], redo["move"])
+        self.assertEqual(undo["move"], second["hint"])
+        self.assertEqual(len(candidates["candidates"]), unknown-1)
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+# SessionManagerTest Class End
+# /////////////////////////////////////////////////////////////////////////////////////////////////
+
+
+if __name__ == "__main__":
+    unittest.main()